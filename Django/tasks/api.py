@@ -0,0 +1,109 @@
+"""REST API for tasks, labels and comments (mounted at /api/ in todo/urls.py).
+
+All lists are paginated with cursors ordered by id, so every page is a single index range scan
+regardless of how deep it is. GET requests accept ?fields= to return only some fields, and
+/api/tasks/bulk/ creates (POST) or updates (PATCH) many tasks in one transaction.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.routers import DefaultRouter
+
+from .models import Comment, Label, Task
+from .serializers import CommentSerializer, LabelSerializer, TaskSerializer, requested_fields
+
+
+class TaskViewSet(viewsets.ModelViewSet):
+    """This viewset lists, creates, updates and deletes tasks.
+
+    The list can be filtered with ?is_finished=true or ?is_finished=false.
+    """
+    serializer_class = TaskSerializer
+    relations = ('assignedTo', 'labels')
+
+    def get_queryset(self):
+        queryset = Task.objects.all()
+        is_finished = self.request.query_params.get('is_finished')
+        if is_finished is not None:
+            queryset = queryset.filter(is_finished=is_finished.lower() in ('1', 'true'))
+        return queryset.prefetch_related(*self.get_lookups())
+
+    def get_lookups(self):
+        """This function returns the relations to prefetch, leaving out those not requested with ?fields=.
+        """
+        fields = requested_fields(self.request)
+        return [name for name in self.relations if fields is None or name in fields]
+
+    def get_bulk_data(self):
+        """This function returns the list of tasks sent to the bulk endpoint.
+        Raises a ValidationError if it is not a list or longer than API_BULK_MAX_SIZE.
+        """
+        if not isinstance(self.request.data, list):
+            raise ValidationError("Expected a list of tasks.")
+        if len(self.request.data) > settings.API_BULK_MAX_SIZE:
+            raise ValidationError("At most %d tasks can be written at once." % settings.API_BULK_MAX_SIZE)
+        return self.request.data
+
+    @action(detail=False, methods=['post', 'patch'])
+    def bulk(self, request):
+        """This function creates (POST) or partially updates (PATCH, every task needs its id) many tasks in one transaction.
+        """
+        data = self.get_bulk_data()
+        with transaction.atomic():
+            if request.method == 'POST':
+                serializer = self.get_serializer(data=data, many=True)
+                serializer.is_valid(raise_exception=True)
+                tasks = serializer.save()
+                prefetch_related_objects(tasks, *self.relations)
+                return Response(self.get_serializer(tasks, many=True).data, status=status.HTTP_201_CREATED)
+
+            ids = [item.get('id') if isinstance(item, dict) else None for item in data]
+            if not all(isinstance(pk, int) for pk in ids):
+                raise ValidationError("Every task needs an id.")
+            if len(set(ids)) != len(ids):
+                raise ValidationError("Every task can only be updated once.")
+            tasks = Task.objects.in_bulk(ids)
+            if len(tasks) != len(ids):
+                raise ValidationError("Unknown tasks: %s" % ", ".join(str(pk) for pk in ids if pk not in tasks))
+
+            serializer = self.get_serializer([tasks[pk] for pk in ids], data=data, many=True, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        tasks = Task.objects.filter(pk__in=ids).prefetch_related(*self.relations)
+        return Response(self.get_serializer(tasks, many=True).data)
+
+
+class LabelViewSet(viewsets.ModelViewSet):
+    """This viewset lists, creates, updates and deletes labels.
+    """
+    queryset = Label.objects.all()
+    serializer_class = LabelSerializer
+
+
+class CommentViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """This viewset lists and creates comments. The list can be filtered by task with ?task=<id>.
+    """
+    serializer_class = CommentSerializer
+
+    def get_queryset(self):
+        queryset = Comment.objects.select_related('comment_user')
+        task = self.request.query_params.get('task')
+        if task is not None:
+            if not task.isdigit():
+                raise ValidationError({'task': ["Expected the id of a task."]})
+            queryset = queryset.filter(comment_task_id=task)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(comment_user=self.request.user, comment_date=timezone.now())
+
+
+router = DefaultRouter()
+router.register('tasks', TaskViewSet, basename='task')
+router.register('labels', LabelViewSet)
+router.register('comments', CommentViewSet, basename='comment')
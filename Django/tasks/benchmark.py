@@ -0,0 +1,198 @@
+"""Benchmarks of the task views, the protocol parser and the mails command (see the benchmark command).
+
+Every scenario is a callable that is run a number of times against the current database (e.g. one
+filled by the generate_data command). Each run is timed and its queries are counted; one more run
+measures the peak memory with tracemalloc, which would slow down the timed runs. All scenarios are
+run inside a transaction that is rolled back, so the writing scenarios leave the data as it was and
+a benchmark can be repeated on the same data, e.g. before and after a release.
+"""
+import math
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from . import instrumentation, protocol, urls
+from .models import Comment, Label, Task
+from .pagination import comment_page, encode_cursor
+
+# a benchmarked operation; route is the name of the URL it requests (None for the commands) and run a callable
+# returning the HTTP status of the response (None for the commands)
+Scenario = namedtuple('Scenario', ['name', 'route', 'run'])
+
+PERCENTILES = (50, 90, 95, 99)
+
+# number of tasks closed and reopened by one run of the batch scenarios
+BATCH_TASKS = 20
+
+
+def routes():
+    """This function returns the names of all routes of tasks/urls.py, e.g. 'tasks:index'.
+    """
+    return ['%s:%s' % (urls.app_name, pattern.name) for pattern in urls.urlpatterns]
+
+
+def percentile(values, p):
+    """This function returns the p-th percentile (nearest rank) of the given values.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def measure(scenario, repeat, warmup):
+    """This function runs a scenario warmup + repeat + 1 times and returns the statistics of the repeat timed runs
+    and the peak memory of the last run.
+    """
+    for _ in range(warmup):
+        scenario.run()
+
+    durations, queries, sql_ms, statuses = [], [], [], Counter()
+    for _ in range(repeat):
+        recorder = instrumentation.QueryRecorder()
+        with recorder.record():
+            start = time.perf_counter()
+            status = scenario.run()
+            durations.append((time.perf_counter() - start) * 1000)
+        queries.append(recorder.count)
+        sql_ms.append(recorder.ms)
+        statuses[status] += 1
+
+    tracemalloc.start()
+    try:
+        scenario.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    ms = lambda value: round(value, 3)
+    return {
+        'name': scenario.name,
+        'route': scenario.route,
+        'runs': repeat,
+        'status': dict((str(status), count) for status, count in statuses.items() if status is not None),
+        'ms': dict([('min', ms(min(durations)))] + [('p%d' % p, ms(percentile(durations, p))) for p in PERCENTILES] +
+                   [('max', ms(max(durations))), ('mean', ms(sum(durations) / repeat))]),
+        'queries': {'min': min(queries), 'p50': percentile(queries, 50), 'max': max(queries)},
+        'sql_ms': {'p50': ms(percentile(sql_ms, 50)), 'max': ms(max(sql_ms))},
+        'peak_memory_kb': peak // 1024,
+    }
+
+
+def protocol_text(todos, usernames):
+    """This function returns a protocol with the given number of TODOs, ten per topic, assigned to the given users.
+    """
+    lines = []
+    for number in range(todos):
+        if number % 10 == 0:
+            lines.append("#### Thema %d" % (number // 10 + 1))
+            lines.append("Es wurde lange diskutiert.")
+        assignees = ", ".join(usernames[(number + offset) % len(usernames)] for offset in range(number % 3)) if usernames else ""
+        lines.append("* TODO %s: Aufgabe %d aus der Sitzung erledigen" % (assignees, number + 1))
+    return "\n".join(lines) + "\n"
+
+
+def scenarios(runs, protocol_todos=200):
+    """This function builds the scenarios of all routes of tasks/urls.py, the protocol parser and the mails command.
+
+    runs is the number of times every scenario will be run. The writing scenarios need that many open tasks.
+    """
+    client = Client(HTTP_HOST='localhost')
+    user, _ = User.objects.get_or_create(username='benchmark')
+    client.force_login(user)
+
+    needed = max(runs * BATCH_TASKS, settings.TASKS_PAGE_SIZE)
+    open_tasks = list(Task.objects.filter(is_finished=False).order_by('finished_date', 'id')[:needed])
+    if len(open_tasks) < needed:
+        raise ValueError("At least %d open tasks are needed, see the generate_data command." % needed)
+    # the task with the most comments
+    busiest = Comment.objects.values('comment_task').annotate(comments=Count('id')).order_by('-comments').values_list('comment_task', flat=True).first()
+    busiest = busiest or open_tasks[0].pk
+    usernames = list(User.objects.exclude(pk=user.pk).order_by('pk').values_list('username', flat=True)[:50])
+    label_ids = list(Label.objects.order_by('pk').values_list('pk', flat=True)[:3])
+    word = open_tasks[0].task_text.split()[0]
+    text = protocol_text(protocol_todos, usernames)
+    todos = list(protocol.todos(protocol.text_lines(text)))
+
+    def get(url, data=None):
+        return lambda: client.get(url, data).status_code
+
+    def post(url, data):
+        return lambda: client.post(url, data).status_code
+
+    def each(view, task_ids):
+        # every run changes another task, so no run is a no-op
+        task_ids = iter(task_ids)
+        return lambda: client.get(reverse(view, args=(next(task_ids),))).status_code
+
+    def batch(action, task_ids):
+        chunks = iter([task_ids[start:start + BATCH_TASKS] for start in range(0, len(task_ids), BATCH_TASKS)])
+        return lambda: client.post(reverse('tasks:batch'), {'action': action, 'tasks': next(chunks)}).status_code
+
+    def parse():
+        list(protocol.todos(protocol.text_lines(text)))
+
+    def import_todos():
+        protocol.import_todos(todos)
+
+    def mails():
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_HOST='localhost'):
+            call_command('mails', stdout=StringIO())
+        mail.outbox = []
+
+    finished_ids = [task.pk for task in open_tasks[:runs]]
+    batch_ids = [task.pk for task in open_tasks[:runs * BATCH_TASKS]]
+    task_form = {'task_text': 'Benchmark', 'task_description': 'Eine Aufgabe aus dem Benchmark',
+                 'finished_date': '2999-01-01', 'assignedTo': [user.pk], 'labels': label_ids, 'important': ''}
+    detail = reverse('tasks:detail', args=(busiest,))
+    # the cursor of the page after the one shown on the detail page
+    _, older = comment_page(Comment.objects.filter(comment_task_id=busiest), '')
+
+    return [
+        # reading
+        Scenario('index', 'tasks:index', get(reverse('tasks:index'))),
+        Scenario('index search', 'tasks:index', get(reverse('tasks:index'), {'filter': word})),
+        Scenario('index next page', 'tasks:index', get(reverse('tasks:index'),
+                                                       {'after': encode_cursor(open_tasks[settings.TASKS_PAGE_SIZE - 1], 'finished_date')})),
+        Scenario('index by activity', 'tasks:index', get(reverse('tasks:index'), {'sort': 'activity'})),
+        Scenario('closed tasks', 'tasks:closedTasks', get(reverse('tasks:closedTasks'))),
+        Scenario('closed tasks by activity', 'tasks:closedTasks', get(reverse('tasks:closedTasks'), {'sort': 'activity'})),
+        Scenario('detail', 'tasks:detail', get(detail)),
+        Scenario('older comments', 'tasks:comments', get(reverse('tasks:comments', args=(busiest,)), {'before': older})),
+        Scenario('create form', 'tasks:create', get(reverse('tasks:create'))),
+        Scenario('new label form', 'tasks:newlabel', get(reverse('tasks:newlabel'))),
+        Scenario('edit form', 'tasks:edit', get(reverse('tasks:edit', args=(open_tasks[0].pk,)))),
+        Scenario('impressum', 'tasks:impressum', get(reverse('tasks:impressum'))),
+        Scenario('protocol form', 'tasks:protocolParse', get(reverse('tasks:protocolParse'))),
+        Scenario('protocol parser', None, parse),
+        # writing
+        Scenario('comment', 'tasks:detail', post(detail, {'comment_text': 'Ein Kommentar aus dem Benchmark'})),
+        Scenario('comment (script)', 'tasks:detail', lambda: client.post(detail, {'comment_text': 'Ein Kommentar aus dem Benchmark'},
+                                                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code),
+        Scenario('create', 'tasks:create', post(reverse('tasks:create'), task_form)),
+        Scenario('new label', 'tasks:newlabel', post(reverse('tasks:newlabel'), {'label_text': 'Benchmark', 'label_description': 'Benchmark',
+                                                                               'label_color': '#000000'})),
+        Scenario('edit', 'tasks:edit', post(reverse('tasks:edit', args=(open_tasks[0].pk,)), task_form)),
+        Scenario('finish', 'tasks:finishTask', each('tasks:finishTask', finished_ids)),
+        Scenario('reopen', 'tasks:reopen', each('tasks:reopen', finished_ids)),
+        Scenario('batch close', 'tasks:batch', batch('close', batch_ids)),
+        Scenario('batch reopen', 'tasks:batch', batch('reopen', batch_ids)),
+        Scenario('protocol import', 'tasks:protocolParse', post(reverse('tasks:protocolParse'), {'protocol_text': text})),
+        Scenario('protocol import (without request)', None, import_todos),
+        Scenario('mails', None, mails),
+    ]
+
+
+def dataset():
+    """This function returns the number of objects of every model the benchmark reads.
+    """
+    return {'users': User.objects.count(), 'tasks': Task.objects.count(),
+            'open_tasks': Task.objects.filter(is_finished=False).count(),
+            'labels': Label.objects.count(), 'comments': Comment.objects.count()}
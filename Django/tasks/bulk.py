@@ -0,0 +1,133 @@
+"""Set-based writes of many tasks at once.
+
+Bulk operations do not send the post_save and m2m_changed signals, so every function here keeps
+the search index, the cached task rows and Task.updated_at up to date itself (see changed()).
+Comments written in bulk need recount_comments() for Task.comment_count and Task.last_activity_at.
+"""
+from django.db import connection, transaction
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Max, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import fragments, search
+from .models import Comment, Task
+
+# number of tasks written per statement
+BATCH_SIZE = 500
+
+
+def create_tasks(tasks):
+    """This function inserts new tasks with bulk INSERTs and returns them with their primary keys set.
+    """
+    if not tasks:
+        return tasks
+    for task in tasks:
+        # see Task.save()
+        if task.last_activity_at is None:
+            task.last_activity_at = task.creation_date
+    with transaction.atomic():
+        Task.objects.bulk_create(tasks, batch_size=BATCH_SIZE)
+        if not connection.features.can_return_ids_from_bulk_insert:
+            # The ids are not returned by SQLite. Inside the transaction nobody else can write,
+            # so the tasks got the consecutive ids up to the highest one.
+            last_pk = Task.objects.order_by('-pk').values_list('pk', flat=True).first()
+            for task, pk in zip(tasks, range(last_pk - len(tasks) + 1, last_pk + 1)):
+                task.pk = pk
+                task._state.adding = False
+                task._state.db = Task.objects.db
+        search.index_tasks([task.pk for task in tasks])
+    return tasks
+
+
+def update_tasks(tasks, fields):
+    """This function writes the given fields of the given tasks with one UPDATE per batch.
+
+    Every field gets a CASE expression choosing the new value by the primary key.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(tasks), BATCH_SIZE):
+            batch = tasks[start:start + BATCH_SIZE]
+            values = {}
+            for name in fields:
+                field = Task._meta.get_field(name)
+                values[field.attname] = Case(*[When(pk=task.pk, then=Value(getattr(task, field.attname), output_field=field)) for task in batch],
+                                             output_field=field)
+            Task.objects.filter(pk__in=[task.pk for task in batch]).update(updated_at=now, **values)
+        for task in tasks:
+            task.updated_at = now
+        changed([task.pk for task in tasks], touch=False)
+
+
+def set_finished(task_ids, is_finished):
+    """This function closes or reopens the given tasks with one UPDATE, which only writes the tasks whose state changes.
+    Returns the number of changed tasks.
+    """
+    task_ids = list(task_ids)
+    count = Task.objects.filter(pk__in=task_ids).exclude(is_finished=is_finished).update(is_finished=is_finished, updated_at=timezone.now())
+    # the search index does not contain the state; the rows of unchanged tasks are invalidated needlessly but cheaply
+    changed(task_ids, touch=False, index=False)
+    return count
+
+
+def add_relations(field_name, pairs):
+    """This function inserts (task id, related id) pairs into the M2M table of Task.assignedTo or Task.labels.
+    """
+    through = getattr(Task, field_name).through
+    column = 'user_id' if field_name == 'assignedTo' else 'label_id'
+    through.objects.bulk_create([through(task_id=task_id, **{column: related_id}) for task_id, related_id in pairs], batch_size=BATCH_SIZE)
+
+
+def set_relations(field_name, task_ids, pairs):
+    """This function replaces the assignees or labels of the given tasks by the given (task id, related id) pairs.
+    """
+    with transaction.atomic():
+        getattr(Task, field_name).through.objects.filter(task_id__in=task_ids).delete()
+        add_relations(field_name, pairs)
+        # the search index does not contain assignees and labels
+        changed(task_ids, index=False)
+
+
+def comment_stats():
+    """This function returns the expressions computing comment_count and last_activity_at of a task from its comments,
+    for an UPDATE or annotate() of tasks.
+    """
+    comments = Comment.objects.filter(comment_task=OuterRef('pk')).order_by().values('comment_task')
+    count = Subquery(comments.annotate(count=Count('id')).values('count'), output_field=IntegerField())
+    newest = Subquery(comments.annotate(newest=Max('comment_date')).values('newest'), output_field=DateTimeField())
+    return {'comment_count': Coalesce(count, 0), 'last_activity_at': Greatest('creation_date', Coalesce(newest, 'creation_date'))}
+
+
+def recount_comments(task_ids=None):
+    """This function recomputes comment_count and last_activity_at of the given tasks (of all if task_ids is None)
+    and returns the ids of the tasks whose values were wrong, which are written with one UPDATE per batch.
+    """
+    stats = comment_stats()
+    tasks = Task.objects.order_by().annotate(actual_count=stats['comment_count'], actual_activity=stats['last_activity_at'])
+    wrong = tasks.exclude(comment_count=F('actual_count'), last_activity_at=F('actual_activity'))
+    if task_ids is None:
+        wrong_ids = list(wrong.values_list('pk', flat=True))
+    else:
+        task_ids = list(task_ids)
+        wrong_ids = [pk for start in range(0, len(task_ids), BATCH_SIZE)
+                     for pk in wrong.filter(pk__in=task_ids[start:start + BATCH_SIZE]).values_list('pk', flat=True)]
+    with transaction.atomic():
+        for start in range(0, len(wrong_ids), BATCH_SIZE):
+            Task.objects.filter(pk__in=wrong_ids[start:start + BATCH_SIZE]).update(updated_at=timezone.now(), **comment_stats())
+        # the rows show the number of comments
+        changed(wrong_ids, touch=False, index=False)
+    return wrong_ids
+
+
+def changed(task_ids, touch=True, index=True):
+    """This function updates the search index (if index is set), the cached rows and (if touch is set) the modification date of written tasks.
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return
+    if index:
+        search.index_tasks(task_ids)
+    fragments.invalidate(task_ids)
+    if touch:
+        for start in range(0, len(task_ids), BATCH_SIZE):
+            Task.objects.filter(pk__in=task_ids[start:start + BATCH_SIZE]).update(updated_at=timezone.now())
@@ -0,0 +1,68 @@
+import hashlib
+
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Task
+
+
+class ConditionalGetMixin:
+    """This mixin answers GET requests with 304 Not Modified if the page has not changed since the client loaded it.
+
+    Whether the page has changed is decided by get_version(), which has to be a single cheap query
+    (usually an aggregate over Task.updated_at), so an unchanged page is never rendered.
+    The ETag also depends on the user, the query string and the CSRF cookie, because the page contains them.
+    """
+
+    def get_version(self):
+        """This function returns a tuple (last_modified, state) describing the current content of the page.
+        last_modified may be None, state is anything that changes together with the page.
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        # pending messages are shown on the page, so it has to be rendered
+        if len(messages.get_messages(request)):
+            return super().get(request, *args, **kwargs)
+
+        last_modified, state = self.get_version()
+        key = repr((request.user.pk, request.META.get('QUERY_STRING', ''), request.META.get('CSRF_COOKIE'), state))
+        etag = quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class TaskConditionalMixin(ConditionalGetMixin):
+    """This mixin implements ConditionalGetMixin for a page showing the task given by the URL argument pk.
+    """
+
+    def get_version(self):
+        """This function returns the date of the last change of the task, which includes changes of its comments (see tasks/signals.py).
+        """
+        updated_at = Task.objects.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
+        return updated_at, updated_at
+
+
+class TaskListConditionalMixin(ConditionalGetMixin):
+    """This mixin implements ConditionalGetMixin for a list of open or closed tasks.
+
+    Attributes:
+        is_finished: Whether the list shows the closed or the open tasks
+    """
+    is_finished = False
+
+    def get_version(self):
+        """This function returns the newest change and the number of the listed tasks, which also changes if a task is deleted.
+        No Last-Modified date is returned, because deleting a task does not change it.
+        """
+        version = Task.objects.filter(is_finished=self.is_finished).aggregate(updated_at=Max('updated_at'), count=Count('id'))
+        return None, (version['updated_at'], version['count'])
@@ -0,0 +1,36 @@
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db.models import F
+
+from .models import Task
+
+TASK_URL = "https://frudo.freitagsrunde.org/tasks/%d/"
+
+
+def open_task_assignments():
+    """This function returns (username, task id, task text) rows of all open tasks, grouped by assignee.
+
+    Tasks are joined to their assignees in one query; unassigned tasks come first with username None.
+    """
+    return Task.objects.filter(is_finished=False).order_by(F('assignedTo__username').asc(nulls_first=True), 'finished_date', 'id') \
+        .values_list('assignedTo__username', 'id', 'task_text')
+
+
+def build_messages(rows):
+    """This function renders the weekly reminder mails from the rows of open_task_assignments.
+
+    Every assignee gets one mail listing their open tasks, the unassigned tasks are sent to EMAIL_GROUP_RECEIVE.
+    """
+    messages = []
+    for username, tasks in groupby(rows, key=lambda row: row[0]):
+        lines = ["    %s ( %s )\n" % (task_text, TASK_URL % task_id) for _, task_id, task_text in tasks]
+        if username is None:
+            body = "Heyho,\n\n folgende Todos sind noch offen und haben keinen Benutzer assigned:\n\n" + "".join(lines)
+            recipient = settings.EMAIL_GROUP_RECEIVE
+        else:
+            body = "Heyho,\n\n du hast noch folgende Todos offen:\n\n" + "".join(lines)
+            recipient = username + "@" + settings.EMAIL_HOST
+        messages.append(EmailMessage('Unbearbeitete ToDos', body, settings.EMAIL_HOST_USER, [recipient]))
+    return messages
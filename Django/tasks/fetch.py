@@ -0,0 +1,125 @@
+"""Fetching of protocols from an URL (e.g. an Etherpad export).
+
+Every fetched protocol is stored in PROTOCOL_CACHE_DIR together with its ETag and Last-Modified
+headers. The next fetch of the same URL is a conditional GET, so an unchanged protocol costs a
+304 response and is not parsed and imported again.
+"""
+import cgi
+import hashlib
+import json
+import os
+import tempfile
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+_session = None
+
+
+class ProtocolFetchError(Exception):
+    """This exception is raised if a protocol cannot be fetched.
+    """
+
+
+def session():
+    """This function returns the HTTP session shared by all fetches, which keeps connections open for reuse.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount('http://', HTTPAdapter(pool_maxsize=4))
+        _session.mount('https://', HTTPAdapter(pool_maxsize=4))
+    return _session
+
+
+def check_url(url):
+    """This function raises ProtocolFetchError unless the URL is an http or https URL of a host in PROTOCOL_URL_HOSTS.
+    """
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+    except ValueError:
+        raise ProtocolFetchError("The protocol URL is not valid")
+    if parts.scheme not in ('http', 'https') or not host:
+        raise ProtocolFetchError("The protocol URL must be an http or https URL")
+    if host.lower() not in settings.PROTOCOL_URL_HOSTS:
+        raise ProtocolFetchError("Protocols cannot be fetched from %s" % host)
+
+
+def cache_paths(url):
+    """This function returns the paths of the cached body and metadata of an URL.
+    """
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(settings.PROTOCOL_CACHE_DIR, key + '.txt'), os.path.join(settings.PROTOCOL_CACHE_DIR, key + '.json')
+
+
+def fetch(url):
+    """This function fetches the protocol at the given URL into the cache.
+
+    Returns the path and the text encoding of the cached protocol, or None if it has not changed since it was last fetched.
+    The encoding is None if the Content-Type header names no charset (requests would assume ISO-8859-1 for text/*).
+    Raises ProtocolFetchError if the URL is not allowed (see check_url), if the protocol cannot be fetched or is larger
+    than PROTOCOL_FETCH_MAX_SIZE. Redirects are not followed, as they could lead to any host.
+    """
+    check_url(url)
+    body_path, meta_path = cache_paths(url)
+    headers = {}
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with session().get(url, headers=headers, timeout=settings.PROTOCOL_FETCH_TIMEOUT, stream=True, allow_redirects=False) as response:
+            if response.status_code == 304:
+                return None
+            if response.is_redirect:
+                raise ProtocolFetchError("The protocol URL redirects to %s" % response.headers['Location'])
+            response.raise_for_status()
+
+            os.makedirs(settings.PROTOCOL_CACHE_DIR, exist_ok=True)
+            size = 0
+            with tempfile.NamedTemporaryFile(dir=settings.PROTOCOL_CACHE_DIR, delete=False) as f:
+                try:
+                    for chunk in response.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > settings.PROTOCOL_FETCH_MAX_SIZE:
+                            raise ProtocolFetchError("The protocol is larger than %d bytes" % settings.PROTOCOL_FETCH_MAX_SIZE)
+                        f.write(chunk)
+                except BaseException:
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, body_path)
+            meta = {'url': url, 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                    'encoding': charset(response.headers.get('Content-Type', ''))}
+    except requests.RequestException as error:
+        raise ProtocolFetchError("The protocol could not be fetched: %s" % error)
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return body_path, meta['encoding']
+
+
+def charset(content_type):
+    """This function returns the charset named in a Content-Type header, or None.
+    """
+    return cgi.parse_header(content_type)[1].get('charset') or None
+
+
+def forget(url):
+    """This function removes an URL from the cache, so that the next fetch imports it again.
+    """
+    for path in cache_paths(url):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
@@ -1,8 +1,10 @@
 from django import forms
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 from .models import Label, Task, Comment
+from . import fetch
 
 class CreateLabelForm(forms.ModelForm):
     """This form class provides a django interface for creating a new label.
@@ -26,12 +28,25 @@ class ProtocolParseForm(forms.Form):
     Attributes:
         protocol_url: The URL where a protocol to be parsed is located
         protocol_text: The text of a protocol that is pasted by hand
+        protocol_file: A protocol file that is uploaded
     """
     protocol_url = forms.CharField(widget=forms.TextInput(attrs={'class':'form-control'}), required=False)
     protocol_text = forms.CharField(widget=forms.Textarea(attrs={'class':'form-control'}), required=False)
+    protocol_file = forms.FileField(widget=forms.ClearableFileInput(attrs={'class':'form-control-file'}), required=False)
+
+    def clean_protocol_url(self):
+        """Checks that a given protocol_url may be fetched (see PROTOCOL_URL_HOSTS), before any request is made.
+        """
+        url = self.cleaned_data['protocol_url'].strip()
+        if url:
+            try:
+                fetch.check_url(url)
+            except fetch.ProtocolFetchError as error:
+                raise ValidationError(str(error))
+        return url
 
     def clean(self):
-        """Checks whether at least a protocol_url or protocol_text is given.
+        """Checks whether at least a protocol_url, protocol_text or protocol_file is given.
         """
         check_form = super(ProtocolParseForm, self).clean()
 
@@ -40,10 +55,11 @@ class ProtocolParseForm(forms.Form):
             for x in (
                 'protocol_url',
                 'protocol_text',
+                'protocol_file',
             )
         ):
-            self._errors['protocol_url'] = self.error_class([("You must enter at least the protocol url or text")])
-            self._errors['protocol_text'] = self.error_class([("You must enter at least the protocol url or text")])
+            self._errors['protocol_url'] = self.error_class([("You must enter at least the protocol url, text or file")])
+            self._errors['protocol_text'] = self.error_class([("You must enter at least the protocol url, text or file")])
 
 class CreateTaskForm(forms.ModelForm):
     """This form class provides a django interface for creating a new task.
@@ -80,3 +96,27 @@ class CreateCommentForm(forms.ModelForm):
         fields = ['comment_text']
 
     comment_text = forms.CharField(widget=forms.Textarea(attrs={'class':'form-control'}))
+
+class BatchActionForm(forms.Form):
+    """This form class provides a django interface for applying an action to many selected tasks at once.
+
+    Attributes:
+        tasks: The selected tasks
+        action: The action to apply (close, reopen, relabel or reassign)
+        labels: The new labels of the tasks (relabel)
+        assignedTo: The new assignees of the tasks (reassign)
+        next: The URL of the task list to which the user returns
+    """
+    ACTIONS = (
+        ('close', 'Close'),
+        ('reopen', 'Reopen'),
+        ('relabel', 'Set labels'),
+        ('reassign', 'Set assignees'),
+    )
+
+    tasks = forms.ModelMultipleChoiceField(queryset=Task.objects.only('id'), widget=forms.MultipleHiddenInput,
+                                           error_messages={'required': "Select at least one task"})
+    action = forms.ChoiceField(choices=ACTIONS, widget=forms.Select(attrs={'class':'form-control'}))
+    labels = forms.ModelMultipleChoiceField(queryset=Label.objects.all(), required=False, widget=forms.SelectMultiple(attrs={'class':'form-control'}))
+    assignedTo = forms.ModelMultipleChoiceField(queryset=User.objects.all(), required=False, widget=forms.SelectMultiple(attrs={'class':'form-control'}))
+    next = forms.CharField(required=False, widget=forms.HiddenInput)
@@ -0,0 +1,120 @@
+"""Caching of the rendered rows of the task lists.
+
+Every task has a version token in the TASK_ROW_CACHE cache, and its rendered row is cached under a
+key containing that token. The signal handlers in tasks/signals.py replace the token whenever the
+task, its assignees or its labels change, which orphans the old row. The key also contains updated_at
+and comment_count, as loaded with the task: a task changed after the list was selected but before the
+tokens were read gets a new updated_at, so the row rendered from its old data is never found again.
+
+The hits and misses are counted in the cache (see the task_row_cache command, which needs a shared
+cache) and in the metrics (see tasks/metrics.py).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+
+from . import metrics
+
+HITS_KEY = 'task-row-hits'
+MISSES_KEY = 'task-row-misses'
+
+# written by the commands changing tasks outside of the web server
+LOCAL_CACHE_WARNING = ("The task row cache is local to every process, so this command cannot invalidate the rows cached by the web server. "
+                       "Configure a shared cache (TASK_ROW_CACHE_BACKEND) or restart the web server.")
+
+
+def cache():
+    """This function returns the cache holding the rendered task rows.
+    """
+    return caches[settings.TASK_ROW_CACHE]
+
+
+def version_key(task_id):
+    return 'task-version:%d' % task_id
+
+
+def invalidate(task_ids):
+    """This function gives the given tasks new version tokens, so that their cached rows are no longer used.
+    """
+    cache().set_many({version_key(task_id): uuid.uuid4().hex for task_id in task_ids}, timeout=None)
+
+
+def versions(task_ids):
+    """This function returns the version tokens of the given tasks, creating the missing ones.
+    """
+    keys = {version_key(task_id): task_id for task_id in task_ids}
+    found = cache().get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        cache().set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def load_rows(tasks, *lookups):
+    """This function attaches the cached rows to a page of tasks.
+
+    Every task gets the attributes row_key and cached_row (None on a miss). Only for the misses the given
+    related lookups are prefetched, because only they have to be rendered.
+    """
+    tasks = list(tasks)
+    task_versions = versions([task.pk for task in tasks])
+    for task in tasks:
+        task.row_key = 'task-row:%d:%s:%s:%d' % (task.pk, task_versions[task.pk],
+                                                 task.updated_at.isoformat(), task.comment_count)
+    rows = cache().get_many([task.row_key for task in tasks])
+    for task in tasks:
+        task.cached_row = rows.get(task.row_key)
+
+    misses = [task for task in tasks if task.cached_row is None]
+    if misses:
+        prefetch_related_objects(misses, *lookups)
+    count(HITS_KEY, len(tasks) - len(misses))
+    count(MISSES_KEY, len(misses))
+    metrics.TASK_ROW_CACHE_REQUESTS.labels('hit').inc(len(tasks) - len(misses))
+    metrics.TASK_ROW_CACHE_REQUESTS.labels('miss').inc(len(misses))
+    return tasks
+
+
+def store_row(task, html):
+    """This function caches the rendered row of a task loaded by load_rows.
+    """
+    cache().set(task.row_key, html, timeout=settings.TASK_ROW_CACHE_TIMEOUT)
+
+
+def count(key, value):
+    if value:
+        cache().add(key, 0, timeout=None)
+        try:
+            cache().incr(key, value)
+        except ValueError:
+            # the counter has just been evicted
+            cache().set(key, value, timeout=None)
+
+
+def stats():
+    """This function returns the numbers of cache hits and misses of task rows.
+    """
+    counters = cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counters.get(HITS_KEY, 0), 'misses': counters.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+class CachedTaskRowsMixin:
+    """This mixin loads the cached rows of the listed tasks (see load_rows) for the {% task_row %} template tag.
+
+    Attributes:
+        row_lookups: The related objects needed to render a row that is not cached
+    """
+    row_lookups = ('assignedTo', 'labels')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        tasks = load_rows(context['object_list'], *self.row_lookups)
+        context['object_list'] = context[self.get_context_object_name(tasks)] = tasks
+        return context
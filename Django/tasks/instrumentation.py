@@ -0,0 +1,54 @@
+"""Measuring the queries of a request or of another piece of code (see RequestMetricsMiddleware and the benchmark command).
+"""
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+# number of characters of a query that are logged
+MAX_SQL_LENGTH = 1000
+
+
+class QueryRecorder:
+    """This class counts the queries sent to the databases and the total time of executing them (see execute_wrapper),
+    which does not include fetching the rows of a result. It also keeps the slowest query and the statements run.
+    Unlike CaptureQueriesContext it also works across requests, which reset the query log of the connections.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_sql = None
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.ms += duration
+            if self.slowest_sql is None or duration > self.slowest_ms:
+                self.slowest_ms, self.slowest_sql = duration, sql
+            # the parameters of executemany() can be large and are never duplicates of a single query
+            self.statements.append((sql, None if many else repr(params)))
+
+    def record(self):
+        """This function returns a context manager in which the queries of all databases are recorded.
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    def duplicates(self, limit=10):
+        """This function returns the statements that were run more than once (e.g. for every row of a list),
+        most frequent first, with the number of runs and the number of runs with the same parameters as an earlier one.
+        """
+        runs = Counter(sql for sql, _ in self.statements)
+        distinct = Counter(sql for sql, _ in set(self.statements))
+        return [{'sql': sql[:MAX_SQL_LENGTH], 'count': count, 'identical': count - distinct[sql]}
+                for sql, count in runs.most_common() if count > 1][:limit]
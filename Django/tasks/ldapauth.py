@@ -0,0 +1,221 @@
+"""Authentication against the LDAP directory with a cache in front of it.
+
+CachedLDAPBackend remembers a successful login for LDAP_AUTH_CACHE_TIMEOUT seconds, keyed by an
+HMAC of the user name and the password. A repeated login within that time costs one query for the
+user instead of a bind, a search and a write of the user's attributes. A password changed in the
+directory is therefore only enforced after the timeout; LDAP_AUTH_CACHE_TIMEOUT=0 disables the cache.
+
+On a cache miss the directory is asked as usual, but the LDAP connection of the thread is reused,
+and the attributes of AUTH_LDAP_USER_ATTR_MAP are only written if they have changed.
+
+The hits, misses and directory requests are counted in LDAP_AUTH_CACHE (see the ldap_auth_stats command,
+which needs a shared cache) and in the metrics (see tasks/metrics.py).
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django_auth_ldap.backend import LDAPBackend
+
+from . import metrics
+
+HITS_KEY = 'ldap-auth-hits'
+MISSES_KEY = 'ldap-auth-misses'
+REQUESTS_KEY = 'ldap-directory-requests'
+LATENCY_KEY = 'ldap-directory-ms'
+
+_connections = threading.local()
+
+
+def cache():
+    """This function returns the cache holding the logins and the counters.
+    """
+    return caches[settings.LDAP_AUTH_CACHE]
+
+
+def login_key(username, password):
+    # the password itself is never stored
+    digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), ('%s\0%s' % (username, password)).encode('utf-8'), hashlib.sha256)
+    return 'ldap-auth:' + digest.hexdigest()
+
+
+def count(key, value):
+    cache().add(key, 0, timeout=None)
+    try:
+        cache().incr(key, value)
+    except ValueError:
+        # the counter has just been evicted
+        cache().set(key, value, timeout=None)
+
+
+def stats():
+    """This function returns the numbers of cache hits and misses, the number of directory requests and their total duration.
+    """
+    counters = cache().get_many([HITS_KEY, MISSES_KEY, REQUESTS_KEY, LATENCY_KEY])
+    return {'hits': counters.get(HITS_KEY, 0), 'misses': counters.get(MISSES_KEY, 0),
+            'directory_requests': counters.get(REQUESTS_KEY, 0), 'directory_ms': counters.get(LATENCY_KEY, 0)}
+
+
+def reset_stats():
+    cache().delete_many([HITS_KEY, MISSES_KEY, REQUESTS_KEY, LATENCY_KEY])
+
+
+class ReusedConnection:
+    """This class wraps an LDAP connection that is kept open for the following logins of the same thread.
+
+    Every login binds again before it searches, so the connection never acts with the identity of an earlier login.
+    A kept connection may have been closed by the server or a firewall meanwhile. An operation failing with
+    SERVER_DOWN is therefore repeated once on a new connection, which gets the options, TLS and bind of the old one.
+    If that fails as well, the connection is dropped and the error raised; the next login opens a new one.
+    """
+
+    def __init__(self, ldap, uri, kwargs):
+        self._ldap = ldap
+        self._uri = uri
+        self._kwargs = kwargs
+        self._connection = ldap.initialize(uri, **kwargs)
+        self._options = {}
+        self._tls_started = False
+        # the arguments of the last successful bind
+        self._bind = None
+
+    def reconnect(self):
+        """This function replaces the connection by a new one in the same state.
+        """
+        self._connection = self._ldap.initialize(self._uri, **self._kwargs)
+        for option, value in self._options.items():
+            self._connection.set_option(option, value)
+        if self._tls_started:
+            self._connection.start_tls_s()
+        if self._bind is not None:
+            args, kwargs = self._bind
+            self._connection.simple_bind_s(*args, **kwargs)
+
+    def call(self, name, *args, **kwargs):
+        """This function calls a method of the connection, repeating it once on a new connection after SERVER_DOWN.
+        """
+        try:
+            return getattr(self._connection, name)(*args, **kwargs)
+        except self._ldap.SERVER_DOWN:
+            pass
+        try:
+            self.reconnect()
+            return getattr(self._connection, name)(*args, **kwargs)
+        except self._ldap.SERVER_DOWN:
+            getattr(_connections, 'pool', {}).pop(self._uri, None)
+            raise
+
+    def set_option(self, option, value):
+        self._options[option] = value
+        self._connection.set_option(option, value)
+
+    def start_tls_s(self):
+        if not self._tls_started:
+            self.call('start_tls_s')
+            self._tls_started = True
+
+    def simple_bind_s(self, who=None, cred=None, *args, **kwargs):
+        # a failed bind leaves the connection unbound
+        self._bind = None
+        result = self.call('simple_bind_s', who, cred, *args, **kwargs)
+        self._bind = ((who, cred) + args, kwargs)
+        return result
+
+    def unbind_s(self):
+        return self._connection.unbind_s()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._connection, name)
+        if not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+
+class ReusingLDAP:
+    """This class stands in for the python-ldap module, but initialize() returns the open connection of the thread.
+    """
+
+    def __init__(self, ldap):
+        self._ldap = ldap
+
+    def initialize(self, uri, **kwargs):
+        if not hasattr(_connections, 'pool'):
+            _connections.pool = {}
+        if uri not in _connections.pool:
+            _connections.pool[uri] = ReusedConnection(self._ldap, uri, kwargs)
+        return _connections.pool[uri]
+
+    def __getattr__(self, name):
+        return getattr(self._ldap, name)
+
+
+def close_connections():
+    """This function closes the LDAP connections kept open by the current thread.
+    """
+    for connection in getattr(_connections, 'pool', {}).values():
+        try:
+            connection.unbind_s()
+        except Exception:
+            pass
+    _connections.pool = {}
+
+
+class CachedLDAPBackend(LDAPBackend):
+    """This backend authenticates against the LDAP directory, caching successful logins (see the module documentation).
+    """
+
+    @property
+    def ldap(self):
+        if self._ldap is None:
+            self._ldap = ReusingLDAP(LDAPBackend.ldap.fget(self))
+        return self._ldap
+
+    def authenticate(self, request=None, username=None, password=None, **kwargs):
+        if not username or not password or not settings.LDAP_AUTH_CACHE_TIMEOUT:
+            return super().authenticate(request, username=username, password=password, **kwargs)
+
+        key = login_key(username.strip(), password)
+        user_id = cache().get(key)
+        if user_id is not None:
+            user = User.objects.filter(pk=user_id, is_active=True).first()
+            if user is not None:
+                count(HITS_KEY, 1)
+                metrics.LDAP_AUTH_CACHE_REQUESTS.labels('hit').inc()
+                return user
+        count(MISSES_KEY, 1)
+        metrics.LDAP_AUTH_CACHE_REQUESTS.labels('miss').inc()
+
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is not None:
+            cache().set(key, user.pk, timeout=settings.LDAP_AUTH_CACHE_TIMEOUT)
+        return user
+
+    def authenticate_ldap_user(self, ldap_user, password):
+        started = time.monotonic()
+        try:
+            user = super().authenticate_ldap_user(ldap_user, password)
+            if user is not None:
+                self.update_user(user, ldap_user)
+            return user
+        finally:
+            seconds = time.monotonic() - started
+            count(REQUESTS_KEY, 1)
+            count(LATENCY_KEY, int(seconds * 1000))
+            metrics.LDAP_DIRECTORY_DURATION.observe(seconds)
+
+    def update_user(self, user, ldap_user):
+        """This function copies the attributes of AUTH_LDAP_USER_ATTR_MAP into the user, saving only the changed fields.
+        (AUTH_LDAP_ALWAYS_UPDATE_USER is off, so django_auth_ldap only populates new users.)
+        """
+        changed = []
+        for field, attribute in self.settings.USER_ATTR_MAP.items():
+            values = (ldap_user.attrs or {}).get(attribute)
+            if values and getattr(user, field) != values[0]:
+                setattr(user, field, values[0])
+                changed.append(field)
+        if changed:
+            user.save(update_fields=changed)
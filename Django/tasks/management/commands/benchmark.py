@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from tasks import benchmark
+import django
+import json
+import platform
+import resource
+
+class Command(BaseCommand):
+    help = "Time every route of tasks/urls.py, the protocol parser and the mails command and report the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs of every scenario")
+        parser.add_argument('--warmup', type=int, default=2, help="Number of untimed runs before the timed ones")
+        parser.add_argument('--protocol-todos', type=int, default=200, help="Number of TODOs of the benchmarked protocol")
+        parser.add_argument('--scenario', action='append', help="Only run the scenarios with the given name (may be repeated)")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--compare', help="JSON report of an earlier run to compare the results with")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['warmup'] < 0:
+            raise CommandError("--repeat must be positive and --warmup must not be negative")
+
+        # every run has its own empty caches, so the results do not depend on what was cached before and a shared
+        # cache never holds rows rendered from the data of the rolled back transaction
+        caches = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-' + alias,
+                          'OPTIONS': {'MAX_ENTRIES': 100000}} for alias in settings.CACHES}
+        with override_settings(CACHES=caches), transaction.atomic():
+            report = self.run(options)
+            # the writing scenarios leave no trace
+            transaction.set_rollback(True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report)
+
+    def run(self, options):
+        # before the writing scenarios add to it
+        dataset = benchmark.dataset()
+        runs = options['warmup'] + options['repeat'] + 1
+        try:
+            scenarios = benchmark.scenarios(runs, options['protocol_todos'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        missing = set(benchmark.routes()) - {scenario.route for scenario in scenarios}
+        if missing:
+            raise CommandError("No scenario for the routes " + ", ".join(sorted(missing)))
+        if options['scenario']:
+            unknown = set(options['scenario']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError("Unknown scenarios: " + ", ".join(sorted(unknown)))
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenario']]
+
+        results = []
+        for scenario in scenarios:
+            results.append(benchmark.measure(scenario, options['repeat'], options['warmup']))
+            self.stderr.write("%-36s p50 %8.1f ms  p95 %8.1f ms  %3d queries" % (
+                scenario.name, results[-1]['ms']['p50'], results[-1]['ms']['p95'], results[-1]['queries']['p50']))
+
+        return {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': dataset,
+            'repeat': options['repeat'],
+            'warmup': options['warmup'],
+            # of the whole process, in KiB on Linux
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'results': results,
+        }
+
+    def compare(self, before, after):
+        """This function writes the changes of the median latency and of the queries of every scenario to stderr.
+        """
+        previous = {result['name']: result for result in before['results']}
+        for result in after['results']:
+            old = previous.get(result['name'])
+            if old is None:
+                continue
+            change = (result['ms']['p50'] - old['ms']['p50']) / old['ms']['p50'] * 100 if old['ms']['p50'] else 0
+            self.stderr.write("%-36s p50 %8.1f -> %8.1f ms (%+6.1f %%)  queries %3d -> %3d" % (
+                result['name'], old['ms']['p50'], result['ms']['p50'], change, old['queries']['p50'], result['queries']['p50']))
@@ -0,0 +1,29 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+class Command(BaseCommand):
+    help = "Remove the expired sessions, in small batches so that the database is never locked for long"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of sessions deleted per statement")
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            # the cache, file and cookie engines expire their sessions themselves
+            store.clear_expired()
+            self.stdout.write("The session engine removes expired sessions itself")
+            return
+
+        model = store.get_model_class()
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(model.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
+        self.stdout.write("%d expired sessions removed" % deleted)
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from tasks import digest
+from tasks.models import Task
+from tasks.pagination import encode_cursor
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN QUERY PLAN on the queries of the task views and fail if one of them scans a whole table"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("EXPLAIN QUERY PLAN is only supported on SQLite.")
+
+        queries = []
+        for url, params in self.requests():
+            with CaptureQueriesContext(connection) as context:
+                self.get(url, params)
+            queries += [("GET %s %s" % (url, params or ''), query['sql']) for query in context.captured_queries]
+        queries += self.mail_queries()
+
+        full_scans = 0
+        for name, sql in queries:
+            if not sql.startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if is_full_scan(step)]
+            full_scans += len(scans)
+            self.stdout.write("%s %s" % ("FULL SCAN" if scans else "ok", name))
+            if scans or options['verbosity'] > 1:
+                self.stdout.write("    " + sql)
+                for step in plan:
+                    self.stdout.write("    -> " + step)
+
+        if full_scans:
+            raise CommandError("%d full table scans found." % full_scans)
+        self.stdout.write("No full table scans in %d queries." % len(queries))
+
+    def requests(self):
+        """This function returns the (url, GET parameters) pairs of all requests to be explained.
+        """
+        requests = [
+            (reverse('tasks:index'), {}),
+            (reverse('tasks:index'), {'filter': 'todo'}),
+            (reverse('tasks:closedTasks'), {}),
+        ]
+        for is_finished, url in ((False, 'tasks:index'), (True, 'tasks:closedTasks')):
+            task = Task.objects.filter(is_finished=is_finished).order_by('finished_date', 'id').first()
+            if task is not None:
+                requests.append((reverse(url), {'after': encode_cursor(task, 'finished_date')}))
+                requests.append((reverse(url), {'before': encode_cursor(task, 'finished_date')}))
+            requests.append((reverse(url), {'sort': 'activity'}))
+            task = Task.objects.filter(is_finished=is_finished).order_by('-last_activity_at', '-id').first()
+            if task is not None:
+                requests.append((reverse(url), {'sort': 'activity', 'after': encode_cursor(task, 'last_activity_at')}))
+        task = Task.objects.first()
+        if task is not None:
+            requests.append((reverse('tasks:detail', args=(task.pk,)), {}))
+            requests.append((reverse('tasks:comments', args=(task.pk,)), {}))
+        return requests
+
+    def get(self, url, params):
+        """This function calls the view of an URL directly, without sessions or middleware.
+        """
+        request = RequestFactory().get(url, params)
+        request.user = User(username='explain_queries', is_active=True)
+        match = resolve(url)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+
+    def mail_queries(self):
+        """This function returns the queries of the mails command.
+        """
+        with CaptureQueriesContext(connection) as context:
+            list(digest.open_task_assignments())
+        return [('mails: open tasks by assignee', query['sql']) for query in context.captured_queries]
+
+
+def is_full_scan(step):
+    """This function checks whether a step of a query plan reads a whole table.
+    """
+    if not step.startswith('SCAN '):
+        return False
+    return not any(marker in step for marker in (' USING ', 'VIRTUAL TABLE', 'CONSTANT ROW', 'SUBQUERY'))
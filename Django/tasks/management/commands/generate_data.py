@@ -0,0 +1,129 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from tasks import bulk, fragments, metrics, search
+from tasks.models import Comment, Label, Task
+from datetime import timedelta
+import itertools
+import random
+
+WORDS = ("Protokoll Sitzung Raum Schlüssel Getränke Kasse Abrechnung Webseite Server Backup Mailingliste Plakat "
+         "Flyer Einführungswoche Erstis Grillen Beamer Drucker Toner Inventur Wiki Umfrage Antrag Fachschaft "
+         "Klausur Sammlung Altklausuren Tutorium Kaffee Kühlschrank Putzplan Anmeldung Workshop Hackathon Newsletter "
+         "aufräumen bestellen klären schreiben abholen reparieren organisieren einladen prüfen verschicken").split()
+
+# number of tasks (with their assignments, labels and comments) written per transaction
+CHUNK_SIZE = 5000
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic users, labels, tasks and comments, e.g. for the benchmark command"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help="Number of users")
+        parser.add_argument('--labels', type=int, default=50, help="Number of labels")
+        parser.add_argument('--tasks', type=int, default=100000, help="Number of tasks")
+        parser.add_argument('--comments', type=int, default=1000000, help="Number of comments, spread unevenly over the tasks")
+        parser.add_argument('--closed-ratio', type=float, default=0.8, help="Share of closed tasks")
+        parser.add_argument('--important-ratio', type=float, default=0.1, help="Share of important tasks")
+        parser.add_argument('--max-assignees', type=int, default=3, help="Maximal number of assignees of a task")
+        parser.add_argument('--max-labels', type=int, default=3, help="Maximal number of labels of a task")
+        parser.add_argument('--prefix', default='user', help="Prefix of the generated user names")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator, the same seed generates the same data")
+
+    def handle(self, *args, **options):
+        for name in ('users', 'labels', 'tasks', 'comments', 'max_assignees', 'max_labels'):
+            if options[name] < 0:
+                raise CommandError("--%s must not be negative" % name.replace('_', '-'))
+        for name in ('closed_ratio', 'important_ratio'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError("--%s must be between 0 and 1" % name.replace('_', '-'))
+        if options['tasks'] and options['comments'] and not (options['users'] or User.objects.exists()):
+            raise CommandError("Comments need at least one user")
+
+        rng = random.Random(options['seed'])
+        user_ids = self.create_users(options['users'], options['prefix']) or list(User.objects.values_list('pk', flat=True))
+        label_ids = self.create_labels(rng, options['labels']) or list(Label.objects.values_list('pk', flat=True))
+
+        comments_left = options['comments']
+        for start in range(0, options['tasks'], CHUNK_SIZE):
+            count = min(CHUNK_SIZE, options['tasks'] - start)
+            # every chunk gets its share of the comments
+            comments = comments_left * count // (options['tasks'] - start)
+            comments_left -= comments
+            with transaction.atomic():
+                tasks = self.create_tasks(rng, count, options['closed_ratio'], options['important_ratio'])
+                task_ids = [task.pk for task in tasks]
+                self.create_relations(rng, 'assignedTo', task_ids, user_ids, options['max_assignees'])
+                self.create_relations(rng, 'labels', task_ids, label_ids, options['max_labels'])
+                self.create_comments(rng, tasks, user_ids, comments)
+                # written in bulk without the signals counting them
+                bulk.recount_comments(task_ids)
+                # the comments are part of the index
+                search.index_tasks(task_ids)
+            self.stdout.write("%d of %d tasks created" % (start + count, options['tasks']))
+
+        self.stdout.write("Created %d users, %d labels, %d tasks and %d comments." % (
+            options['users'], options['labels'], options['tasks'], options['comments']))
+        if options['tasks'] and metrics.is_process_local(fragments.cache()):
+            self.stderr.write(fragments.LOCAL_CACHE_WARNING)
+
+    def create_users(self, count, prefix):
+        """This function creates users named <prefix><number>, all with the password "benchmark", and returns their ids.
+        """
+        first = User.objects.filter(username__startswith=prefix).count()
+        password = make_password('benchmark')
+        names = ['%s%d' % (prefix, number) for number in range(first, first + count)]
+        User.objects.bulk_create([User(username=name, email=name + '@example.com', password=password) for name in names], batch_size=bulk.BATCH_SIZE)
+        return list(User.objects.filter(username__in=names).values_list('pk', flat=True)) if names else []
+
+    def create_labels(self, rng, count):
+        labels = [Label(label_text="%s %d" % (rng.choice(WORDS), number), label_description=sentence(rng, 5),
+                        label_color="#%06x" % rng.randrange(0x1000000)) for number in range(count)]
+        for label in labels:
+            # a few labels only, signals are no problem here
+            label.save()
+        return [label.pk for label in labels]
+
+    def create_tasks(self, rng, count, closed_ratio, important_ratio):
+        """This function creates tasks which were created within the last two years and are due up to two months later.
+        """
+        now = timezone.now()
+        tasks = []
+        for _ in range(count):
+            creation_date = now - timedelta(seconds=rng.randrange(2 * 365 * 24 * 3600))
+            tasks.append(Task(task_text=sentence(rng, rng.randint(2, 6))[:64],
+                              task_description=sentence(rng, rng.randint(5, 40))[:512],
+                              creation_date=creation_date,
+                              finished_date=(creation_date + timedelta(days=rng.randint(1, 60))).date(),
+                              is_finished=rng.random() < closed_ratio,
+                              important=rng.random() < important_ratio))
+        return bulk.create_tasks(tasks)
+
+    def create_relations(self, rng, field_name, task_ids, related_ids, maximum):
+        if not related_ids:
+            return
+        bulk.add_relations(field_name, [(task_id, related_id) for task_id in task_ids
+                                        for related_id in rng.sample(related_ids, min(len(related_ids), rng.randint(0, maximum)))])
+
+    def create_comments(self, rng, tasks, user_ids, count):
+        """This function creates comments written between the creation of their task and now. A few tasks get most of
+        them (Pareto distributed), the way long-running tasks collect hundreds of comments.
+        """
+        if not count or not tasks:
+            return
+        weights = list(itertools.accumulate(rng.paretovariate(1.2) for _ in tasks))
+        now = timezone.now()
+        for start in range(0, count, bulk.BATCH_SIZE):
+            size = min(bulk.BATCH_SIZE, count - start)
+            Comment.objects.bulk_create([Comment(comment_task_id=task.pk, comment_user_id=rng.choice(user_ids),
+                                                 comment_text=sentence(rng, rng.randint(3, 30))[:512],
+                                                 comment_date=task.creation_date + (now - task.creation_date) * rng.random())
+                                         for task in rng.choices(tasks, cum_weights=weights, k=size)])
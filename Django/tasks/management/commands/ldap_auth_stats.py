@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks import ldapauth, metrics
+
+class Command(BaseCommand):
+    help = "Show the counters of the LDAP login cache and the latency of the directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after showing them")
+
+    def handle(self, *args, **options):
+        if metrics.is_process_local(ldapauth.cache()):
+            raise CommandError("LDAP_AUTH_CACHE is local to every process, so this command cannot see the counters of the web server. "
+                               "Configure a shared cache or read frudo_ldap_auth_cache_requests_total and "
+                               "frudo_ldap_directory_duration_seconds at /metrics.")
+        stats = ldapauth.stats()
+        total = stats['hits'] + stats['misses']
+        self.stdout.write("hits: %d, misses: %d, hit rate: %.1f%%" % (stats['hits'], stats['misses'], 100.0 * stats['hits'] / total if total else 0))
+        requests = stats['directory_requests']
+        self.stdout.write("directory requests: %d, average latency: %.1f ms" % (requests, float(stats['directory_ms']) / requests if requests else 0))
+        if options['reset']:
+            ldapauth.reset_stats()
@@ -1,40 +1,43 @@
 from django.core.management.base import BaseCommand
-from django.core.mail import EmailMessage
-from django.contrib.auth.models import User
+from django.core.mail import get_connection
 from django.conf import settings
 
-from tasks.models import Task
+from tasks import digest, metrics
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = "Send mails to all users with unfinished polls"
+    help = "Send mails to all users with unfinished tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only build the mails and report counts and timing")
 
     def handle(self, *args, **options):
-        if (settings.EMAIL_HOST == "example.com"):
+        if (settings.EMAIL_HOST == "example.com" and not options['dry_run']):
             return
+
+        start = time.perf_counter()
+        rows = list(digest.open_task_assignments())
+        queried = time.perf_counter()
+        messages = digest.build_messages(rows)
+        rendered = time.perf_counter()
+
+        if options['dry_run']:
+            self.stdout.write("Would send %d mails about %d open task assignments (query %.1f ms, render %.1f ms)." % (
+                len(messages), len(rows), (queried - start) * 1000, (rendered - queried) * 1000))
+            return
+
         logger.info("Sending emails to users");
-        users = User.objects.all()
-        for user in users:
-            tasks = Task.objects.filter(is_finished=False, assignedTo__in=[user.id]).distinct()
-            if len(tasks) == 0:
-                continue
-            email_content = "Heyho,\n\n du hast noch folgende Todos offen:\n\n"
-            for task in tasks:
-                email_content += "    " + task.task_text + " ( https://frudo.freitagsrunde.org/tasks/" + str(task.id) + "/ )\n"
-
-            mail = EmailMessage('Unbearbeitete ToDos', email_content, settings.EMAIL_HOST_USER, [user.username + "@" + settings.EMAIL_HOST])
-            mail.send()
-
-        unassigned = Task.objects.filter(is_finished=False, assignedTo=None)
-        if len(unassigned) == 0:
-                return
-        email_content = "Heyho,\n\n folgende Todos sind noch offen und haben keinen Benutzer assigned:\n\n"
-
-        for task in unassigned:
-            print(task.task_text)
-            email_content += "    " + task.task_text + " ( https://frudo.freitagsrunde.org/tasks/" + str(task.id) + "/ )\n"
-
-        mail = EmailMessage('Unbearbeitete ToDos', email_content, settings.EMAIL_HOST_USER, [settings.EMAIL_GROUP_RECEIVE])
-        mail.send()
+        sending = time.perf_counter()
+        try:
+            # one connection for all mails
+            sent = get_connection().send_messages(messages)
+        except Exception:
+            metrics.MAIL_FAILURES.labels('reminder').inc(len(messages))
+            raise
+        finally:
+            metrics.MAIL_SEND_DURATION.labels('reminder').observe(time.perf_counter() - sending)
+        metrics.MAILS_SENT.labels('reminder').inc(sent)
+        logger.info("Sent %d mails in %.1f ms", sent, (time.perf_counter() - start) * 1000)
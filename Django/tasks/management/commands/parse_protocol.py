@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from tasks import fragments, metrics, outbox, protocol
+import os
+
+class Command(BaseCommand):
+    help = "Import the TODOs of protocol files, or of all protocols in a directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Protocol files or directories of protocol files")
+        parser.add_argument('--encoding', default='utf-8', help="Encoding of the protocol files")
+        parser.add_argument('--mail', action='store_true', help="Queue the notification mail for every imported protocol")
+
+    def handle(self, *args, **options):
+        total = 0
+        for path in self.protocol_files(options['paths']):
+            with open(path, encoding=options['encoding']) as lines:
+                todos = list(protocol.todos(lines))
+            tasks, unknown_users = protocol.import_todos(todos)
+            total += len(tasks)
+            self.stdout.write("%s: %d tasks imported" % (path, len(tasks)))
+            if unknown_users:
+                self.stdout.write("    unknown users: " + ", ".join(unknown_users))
+            if options['mail'] and todos:
+                outbox.enqueue('SitzungsTODOs', protocol.mail_body(todos), [settings.EMAIL_GROUP_RECEIVE])
+        self.stdout.write("%d tasks imported." % total)
+        if total and metrics.is_process_local(fragments.cache()):
+            self.stderr.write(fragments.LOCAL_CACHE_WARNING)
+
+    def protocol_files(self, paths):
+        """This function yields the given files and the files in the given directories, in name order.
+        """
+        for path in paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if os.path.isfile(os.path.join(path, name)) and not name.startswith('.'):
+                        yield os.path.join(path, name)
+            elif os.path.isfile(path):
+                yield path
+            else:
+                raise CommandError("%s does not exist" % path)
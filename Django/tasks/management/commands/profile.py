@@ -0,0 +1,60 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import override_settings
+
+from tasks import benchmark, profiling, protocol
+from io import StringIO
+import pstats
+
+class Command(BaseCommand):
+    help = "Profile the mails command or the parsing (and import) of protocols and write the profile to PROFILE_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['mails', 'protocol'], help="What to profile")
+        parser.add_argument('paths', nargs='*', help="Protocol files to parse (default: a generated protocol)")
+        parser.add_argument('--todos', type=int, default=5000, help="Number of TODOs of the generated protocol")
+        parser.add_argument('--import', action='store_true', dest='import_todos',
+                            help="Also import the TODOs, in a transaction that is rolled back")
+        parser.add_argument('--limit', type=int, default=25, help="Number of functions listed, by cumulative time")
+
+    def handle(self, *args, **options):
+        if options['target'] == 'mails':
+            if options['paths'] or options['import_todos']:
+                raise CommandError("Protocol files and --import only apply to the protocol target")
+            _, profile = profiling.profile_call(self.mails)
+        else:
+            text = None
+            if not options['paths']:
+                # generated before the profile starts
+                usernames = list(User.objects.order_by('pk').values_list('username', flat=True)[:50])
+                text = benchmark.protocol_text(options['todos'], usernames)
+            _, profile = profiling.profile_call(self.protocol, options['paths'], text, options['import_todos'])
+
+        base = profiling.save(profile, options['target'])
+        listing = StringIO()
+        pstats.Stats(profile, stream=listing).sort_stats('cumulative').print_stats(options['limit'])
+        self.stdout.write(listing.getvalue())
+        self.stdout.write("Profile written to %s.pstats and %s.collapsed.txt" % (base, base))
+
+    def mails(self):
+        """This function runs the mails command, whose mails are kept in memory instead of being sent.
+        """
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_HOST='localhost'):
+            call_command('mails', stdout=StringIO())
+
+    def protocol(self, paths, text, import_todos):
+        """This function parses the given protocol files or text, and imports their TODOs if asked to.
+        """
+        todos = []
+        for path in paths:
+            with open(path) as lines:
+                todos += protocol.todos(lines)
+        if text is not None:
+            todos += protocol.todos(protocol.text_lines(text))
+        if import_todos:
+            with transaction.atomic():
+                protocol.import_todos(todos)
+                transaction.set_rollback(True)
+        self.stdout.write("%d TODOs parsed." % len(todos))
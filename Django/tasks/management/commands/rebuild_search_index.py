@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks import search
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of all tasks and comments"
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write("The full-text index is only available on SQLite, nothing to do.")
+            return
+        with transaction.atomic():
+            count = search.rebuild_index()
+        self.stdout.write("Indexed %d tasks." % count)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from tasks import bulk, fragments, metrics
+
+class Command(BaseCommand):
+    help = "Recompute the number of comments and the last activity of all tasks and fix the wrong ones"
+
+    def handle(self, *args, **options):
+        wrong_ids = bulk.recount_comments()
+        self.stdout.write("Fixed %d tasks." % len(wrong_ids))
+        if wrong_ids and metrics.is_process_local(fragments.cache()):
+            self.stderr.write(fragments.LOCAL_CACHE_WARNING)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tasks import outbox
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Send the mails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running and drain the outbox periodically")
+        parser.add_argument('--interval', type=float, default=10, help="Seconds to wait between two runs with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, failed = outbox.send_queued_mail()
+            except Exception:
+                if not options['loop']:
+                    raise
+                # e.g. a locked or lost database, which must not end the worker
+                logger.exception("Sending the queued mails failed")
+                close_old_connections()
+            else:
+                if sent or failed:
+                    logger.info("Sent %d queued mails, %d failed", sent, failed)
+                    self.stdout.write("Sent %d mails, %d failed." % (sent, failed))
+                if not options['loop']:
+                    return
+            time.sleep(options['interval'])
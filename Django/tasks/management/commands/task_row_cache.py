@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks import fragments, metrics
+
+class Command(BaseCommand):
+    help = "Show the hit and miss counters of the task row cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after showing them")
+        parser.add_argument('--clear', action='store_true', help="Remove all cached rows")
+
+    def handle(self, *args, **options):
+        if metrics.is_process_local(fragments.cache()):
+            raise CommandError("The task row cache is local to every process, so this command cannot see the cache of the web server. "
+                               "Configure a shared cache (TASK_ROW_CACHE_BACKEND) or read frudo_task_row_cache_requests_total at /metrics.")
+        stats = fragments.stats()
+        total = stats['hits'] + stats['misses']
+        self.stdout.write("hits: %d, misses: %d, hit rate: %.1f%%" % (stats['hits'], stats['misses'], 100.0 * stats['hits'] / total if total else 0))
+        if options['clear']:
+            fragments.cache().clear()
+        elif options['reset']:
+            fragments.reset_stats()
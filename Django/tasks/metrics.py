@@ -0,0 +1,121 @@
+"""Prometheus metrics, served in the text format by metrics_view (/metrics, see todo/urls.py).
+
+The web server, the send_queued_mail loop and the mails command run in different processes. If the
+environment variable PROMETHEUS_MULTIPROC_DIR names a directory (see entrypoint.sh), every process
+writes its counters and histograms to its own files in there, and metrics_view adds up the files
+of all processes, including those that have exited. Without it only the serving process is seen.
+
+The counters of the caches (e.g. of the task rows) are exported here, because the caches are local to
+every process by default, so a management command cannot see them.
+
+The numbers of open and closed tasks and of queued mails are not kept by the processes but counted
+when the metrics are scraped, at most every METRICS_AGGREGATE_TIMEOUT seconds (see AggregateCollector).
+"""
+import hmac
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from .models import OutgoingMail, Task
+
+AGGREGATES_KEY = 'metrics-aggregates'
+
+# the metrics of the processes, collected by metrics_view
+_registry = CollectorRegistry()
+
+REQUEST_DURATION = Histogram('frudo_request_duration_seconds', "Duration of the requests by view (URL name), method and status",
+                             ['view', 'method', 'status'], registry=_registry)
+REQUEST_QUERIES = Histogram('frudo_request_queries', "Number of database queries of the requests by view",
+                            ['view'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, float('inf')), registry=_registry)
+MAIL_SEND_DURATION = Histogram('frudo_mail_send_duration_seconds', "Duration of sending mails, by source "
+                               "(reminder: the mails command, outbox: the queued protocol mails)", ['source'], registry=_registry)
+MAILS_SENT = Counter('frudo_mails_sent_total', "Number of sent mails by source", ['source'], registry=_registry)
+MAIL_FAILURES = Counter('frudo_mail_failures_total', "Number of mails that could not be sent, by source", ['source'], registry=_registry)
+PROTOCOL_IMPORT_TODOS = Histogram('frudo_protocol_import_todos', "Number of TODOs of the imported protocols",
+                                  buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, float('inf')), registry=_registry)
+PROTOCOL_UNKNOWN_USERS = Counter('frudo_protocol_unknown_users_total', "Number of unknown assignees in the imported protocols",
+                                 registry=_registry)
+TASK_ROW_CACHE_REQUESTS = Counter('frudo_task_row_cache_requests_total', "Number of task rows looked up in the cache, by result (hit, miss)",
+                                  ['result'], registry=_registry)
+LDAP_AUTH_CACHE_REQUESTS = Counter('frudo_ldap_auth_cache_requests_total', "Number of LDAP logins looked up in the login cache, by result (hit, miss)",
+                                   ['result'], registry=_registry)
+LDAP_DIRECTORY_DURATION = Histogram('frudo_ldap_directory_duration_seconds', "Duration of the logins that asked the LDAP directory",
+                                    registry=_registry)
+
+
+def is_multiprocess():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'))
+
+
+def is_process_local(cache):
+    """This function checks whether a cache only lives in the memory of the current process (or stores nothing),
+    so another process, e.g. a management command, cannot see what the web server stored in it.
+    """
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def observe_request(view, method, status, seconds, queries):
+    """This function records a request (see RequestMetricsMiddleware); requests not matching a URL are recorded as view "unresolved".
+    """
+    view = view or 'unresolved'
+    REQUEST_DURATION.labels(view, method, str(status)).observe(seconds)
+    REQUEST_QUERIES.labels(view).observe(queries)
+
+
+def aggregates():
+    """This function returns the numbers of open and closed tasks and of queued mails, counted at most every METRICS_AGGREGATE_TIMEOUT seconds.
+    """
+    cache = caches[settings.METRICS_AGGREGATE_CACHE]
+    values = cache.get(AGGREGATES_KEY)
+    if values is None:
+        # one GROUP BY over the index on is_finished, and the index of the due mails
+        tasks = dict(Task.objects.order_by().values_list('is_finished').annotate(count=Count('id')))
+        values = {'open': tasks.get(False, 0), 'closed': tasks.get(True, 0),
+                  'queued_mails': OutgoingMail.objects.filter(sent_date=None).count()}
+        cache.set(AGGREGATES_KEY, values, settings.METRICS_AGGREGATE_TIMEOUT)
+    return values
+
+
+class AggregateCollector:
+    """This collector reports the gauges computed by aggregates().
+    """
+
+    def collect(self):
+        values = aggregates()
+        tasks = GaugeMetricFamily('frudo_tasks', "Number of tasks by state", labels=['state'])
+        tasks.add_metric(['open'], values['open'])
+        tasks.add_metric(['closed'], values['closed'])
+        yield tasks
+        yield GaugeMetricFamily('frudo_outbox_queued_mails', "Number of mails in the outbox that are not sent yet", value=values['queued_mails'])
+
+
+class ProcessCollector:
+    """This collector reports the metrics of the current process only.
+    """
+
+    def collect(self):
+        return _registry.collect()
+
+
+def metrics_view(request):
+    """This view returns all metrics in the Prometheus text format. The request has to carry METRICS_TOKEN
+    in the header "Authorization: Bearer <token>". Without a token the metrics are only served with DEBUG on.
+    """
+    if not settings.METRICS_TOKEN and not settings.DEBUG:
+        raise Http404("METRICS_TOKEN is not set")
+    if settings.METRICS_TOKEN and not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + settings.METRICS_TOKEN):
+        return HttpResponseForbidden()
+    registry = CollectorRegistry()
+    if is_multiprocess():
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(ProcessCollector())
+    registry.register(AggregateCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
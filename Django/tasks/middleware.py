@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+import json
+import logging
+import os
+import time
+
+from . import instrumentation, metrics, profiling, routers
+
+logger = logging.getLogger('tasks.metrics')
+
+PIN_COOKIE = 'replica_pin'
+
+
+class ReplicaPinningMiddleware:
+    """This middleware keeps requests on the default database where a replica could show outdated data (see tasks/routers.py).
+
+    Requests that are not GET or HEAD and requests carrying the pin cookie read from the default database.
+    The pin cookie is set for REPLICA_PIN_SECONDS on every response to a request that wrote to the database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.reset()
+        if request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES:
+            routers.pin()
+        try:
+            response = self.get_response(request)
+            if routers.has_written() and settings.DATABASE_REPLICA_ALIASES:
+                response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        finally:
+            routers.reset()
+        return response
+
+
+class RequestMetricsMiddleware:
+    """This middleware measures every request: its duration, the number and the time of its queries, the slowest query
+    and the time spent rendering the template of the response.
+
+    The numbers are sent in the Server-Timing header (shown in the network tab of the browsers) and logged as a line
+    of JSON to the logger tasks.metrics, tagged with the name of the URL (e.g. tasks:detail). A request slower than
+    REQUEST_METRICS_SLOW_MS or with more than REQUEST_METRICS_MAX_QUERIES queries is logged as a warning, together
+    with the queries that were run more than once. The duration and the number of queries also go into the Prometheus
+    metrics (see tasks/metrics.py). REQUEST_METRICS=False turns the middleware off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = instrumentation.QueryRecorder()
+        request.template_ms = 0.0
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        duration = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = 'db;dur=%.1f;desc="%d queries", tpl;dur=%.1f, total;dur=%.1f' % (
+            recorder.ms, recorder.count, request.template_ms, duration)
+
+        view = request.resolver_match.view_name if request.resolver_match else None
+        metrics.observe_request(view, request.method, response.status_code, duration / 1000, recorder.count)
+
+        line = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(duration, 1),
+            'queries': recorder.count,
+            'sql_ms': round(recorder.ms, 1),
+            'template_ms': round(request.template_ms, 1),
+            'slowest_query_ms': round(recorder.slowest_ms, 1),
+            'slowest_query': recorder.slowest_sql and recorder.slowest_sql[:instrumentation.MAX_SQL_LENGTH],
+        }
+        if duration > settings.REQUEST_METRICS_SLOW_MS or recorder.count > settings.REQUEST_METRICS_MAX_QUERIES:
+            line['duplicates'] = recorder.duplicates()
+            logger.warning(json.dumps(line), extra={'metrics': line})
+        else:
+            logger.info(json.dumps(line), extra={'metrics': line})
+        return response
+
+    def process_template_response(self, request, response):
+        # coming first in MIDDLEWARE, this is the last middleware to see the response before it is rendered
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.template_ms += (time.perf_counter() - started) * 1000
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfilerMiddleware:
+    """This middleware runs the view of a request under cProfile if a superuser asks for it with the header
+    "X-Profile: 1" or the query parameter profile=1. The profile is written to PROFILE_DIR (see tasks/profiling.py),
+    the response names the files in its X-Profile header. PROFILE_REQUESTS=False turns the middleware off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_REQUESTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if '1' not in (request.META.get('HTTP_X_PROFILE'), request.GET.get('profile')):
+            return None
+        if not request.user.is_superuser:
+            return None
+
+        def view():
+            response = view_func(request, *view_args, **view_kwargs)
+            # most of the time is spent rendering the template
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
+
+        response, profile = profiling.profile_call(view)
+        name = request.resolver_match.view_name if request.resolver_match else view_func.__name__
+        response['X-Profile'] = os.path.basename(profiling.save(profile, name))
+        return response
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE tasks_task_fts USING fts5(task_text, task_description, comment_text)'
+    )
+    schema_editor.execute(
+        'INSERT INTO tasks_task_fts(rowid, task_text, task_description, comment_text) '
+        'SELECT t.id, t.task_text, t.task_description, '
+        "(SELECT group_concat(c.comment_text, ' ') FROM tasks_comment c WHERE c.comment_task_id = t.id) "
+        'FROM tasks_task t'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE tasks_task_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0013_remove_task_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.10 on 2026-10-18 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0014_task_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['comment_task', 'comment_date'], name='comment_task_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['is_finished', 'finished_date', 'id'], name='task_finished_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.10 on 2026-10-18 14:36
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_task_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('recipients', models.TextField()),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_date', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingmail',
+            index=models.Index(fields=['sent_date', 'next_attempt_date'], name='outgoingmail_due_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count, DateTimeField, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+import django.utils.timezone
+
+
+def compute_comment_stats(apps, schema_editor):
+    Task = apps.get_model('tasks', 'Task')
+    Comment = apps.get_model('tasks', 'Comment')
+    comments = Comment.objects.filter(comment_task=OuterRef('pk')).order_by().values('comment_task')
+    count = Subquery(comments.annotate(count=Count('id')).values('count'), output_field=IntegerField())
+    newest = Subquery(comments.annotate(newest=Max('comment_date')).values('newest'), output_field=DateTimeField())
+    Task.objects.update(comment_count=Coalesce(count, 0), last_activity_at=Greatest('creation_date', Coalesce(newest, 'creation_date')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0017_task_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(compute_comment_stats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['is_finished', 'last_activity_at', 'id'], name='task_activity_idx'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
+import threading
 
 class Label(models.Model):
     """This class provides a label for differentiating tasks into groups.
@@ -19,6 +20,26 @@ class Label(models.Model):
     def __str__(self):
         return self.label_text
 
+# the fields of Task that are only written by the comments
+COMMENT_STATS_FIELDS = ('comment_count', 'last_activity_at')
+
+# the ids of the tasks being deleted by the current thread, whose comments are deleted first (see tasks/signals.py)
+_deleting = threading.local()
+
+def deleting_tasks():
+    if not hasattr(_deleting, 'task_ids'):
+        _deleting.task_ids = set()
+    return _deleting.task_ids
+
+class TaskQuerySet(models.QuerySet):
+
+    def delete(self):
+        try:
+            return super().delete()
+        finally:
+            # also if the deletion failed and was rolled back
+            deleting_tasks().clear()
+
 # Create your models here.
 class Task(models.Model):
     """This class represents tasks.
@@ -32,6 +53,13 @@ class Task(models.Model):
         assignedTo: The list of accounts to which the task is assigned
         labels: The list of labels for this task
         progress: An integer value (0..100) to describe the progress of the task in percentage
+        updated_at: The date of the last change of the task, its assignees, labels or comments
+        comment_count: The number of comments of the task
+        last_activity_at: The date of the newest comment, or the creation date of a task without comments
+
+    comment_count and last_activity_at are kept up to date by the signal handlers of the comments (see tasks/signals.py)
+    and recomputed by the repair_comment_stats command. A task edited by a user is saved with update_fields that
+    leave them out (see task_update_fields()), so the save cannot undo a comment written since the task was loaded.
     """
 
     task_text = models.CharField(max_length=64)
@@ -42,10 +70,44 @@ class Task(models.Model):
     important = models.BooleanField()
     assignedTo = models.ManyToManyField(User, blank=True)
     labels = models.ManyToManyField(Label, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(blank=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # open/closed task lists and mails: filtered by is_finished, ordered by (finished_date, id)
+            models.Index(fields=['is_finished', 'finished_date', 'id'], name='task_finished_date_idx'),
+            # last change of the open/closed task lists (see tasks/conditional.py)
+            models.Index(fields=['is_finished', 'updated_at'], name='task_updated_idx'),
+            # open/closed task lists ordered by recent activity
+            models.Index(fields=['is_finished', 'last_activity_at', 'id'], name='task_activity_idx'),
+        ]
 
     def __str__(self):
         return self.task_text
 
+    def save(self, *args, **kwargs):
+        if 'last_activity_at' not in self.get_deferred_fields() and self.last_activity_at is None:
+            self.last_activity_at = self.creation_date
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            # also if the deletion failed and was rolled back
+            deleting_tasks().clear()
+
+def task_update_fields(field_names):
+    """This function returns the update_fields for saving a task of which the given fields were changed:
+    the given fields except the relations and the comment stats, and the modification date.
+    """
+    return [name for name in field_names
+            if name not in COMMENT_STATS_FIELDS and not Task._meta.get_field(name).many_to_many] + ['updated_at']
+
 class Subtask(models.Model):
     """Currently not used."""
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
@@ -67,3 +129,42 @@ class Comment(models.Model):
     comment_user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment_task = models.ForeignKey(Task, on_delete=models.CASCADE)
     comment_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # comments of a task ordered by date
+            models.Index(fields=['comment_task', 'comment_date'], name='comment_task_date_idx'),
+        ]
+
+class OutgoingMail(models.Model):
+    """This class represents a mail waiting in the outbox to be sent by the send_queued_mail command.
+
+    Attributes:
+        subject: The subject of the mail
+        body: The text of the mail
+        from_email: The sender address
+        recipients: The comma separated list of receiver addresses
+        creation_date: The date on which the mail was queued
+        next_attempt_date: The date from which on the next attempt to send the mail may be made
+        sent_date: The date on which the mail was sent (empty while it is queued)
+        attempts: The number of attempts to send the mail, counted when a run of send_queued_mail claims it
+        last_error: The error of the last failed attempt
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()
+    creation_date = models.DateTimeField(default=timezone.now)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # queued mails that are due
+            models.Index(fields=['sent_date', 'next_attempt_date'], name='outgoingmail_due_idx'),
+        ]
+
+    def __str__(self):
+        return self.subject
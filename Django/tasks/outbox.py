@@ -0,0 +1,138 @@
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from . import metrics, routers
+from .models import OutgoingMail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(subject, body, recipients, from_email=None):
+    """This function puts a mail into the outbox instead of sending it right away.
+
+    Nothing is queued if no mail server is configured (EMAIL_HOST is example.com).
+    Returns the queued OutgoingMail or None.
+    """
+    if (settings.EMAIL_HOST == "example.com"):
+        return None
+    return OutgoingMail.objects.create(subject=subject, body=body,
+                                       from_email=from_email or settings.EMAIL_HOST_USER,
+                                       recipients=",".join(recipients))
+
+
+def send_queued_mail():
+    """This function sends all due mails of the outbox over a single SMTP connection.
+
+    A mail that cannot be sent is retried later; the delay starts at MAIL_QUEUE_RETRY_DELAY seconds and
+    doubles with every attempt. After MAIL_QUEUE_MAX_ATTEMPTS failed attempts the mail is given up, a mail
+    rejected permanently (see is_permanent()) at once. If the connection does not answer after a failure,
+    it is opened again for the following mails.
+    The due mails are claimed first (see claim()), so concurrent runs never send the same mail.
+    Returns the number of sent and failed mails.
+    """
+    now = timezone.now()
+    # a replica could still list mails that have already been sent (see tasks/routers.py)
+    due = claim(OutgoingMail.objects.db_manager(routers.PRIMARY).filter(sent_date=None, attempts__lt=settings.MAIL_QUEUE_MAX_ATTEMPTS,
+                                                                        next_attempt_date__lte=now).order_by('id'), now)
+    if not due:
+        return 0, 0
+
+    sent = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except (smtplib.SMTPException, OSError) as error:
+        for mail in due:
+            failed(mail, error)
+        return 0, len(due)
+
+    try:
+        for index, mail in enumerate(due):
+            start = time.perf_counter()
+            try:
+                message = EmailMessage(mail.subject, mail.body, mail.from_email, mail.recipients.split(","), connection=connection)
+                message.send()
+            except Exception as error:
+                # e.g. an invalid address, which must not stop the mails behind it
+                failed(mail, error, is_permanent(error))
+                if not is_alive(connection):
+                    connection.close()
+                    try:
+                        connection.open()
+                    except (smtplib.SMTPException, OSError) as open_error:
+                        for rest in due[index + 1:]:
+                            failed(rest, open_error)
+                        break
+                continue
+            finally:
+                metrics.MAIL_SEND_DURATION.labels('outbox').observe(time.perf_counter() - start)
+            metrics.MAILS_SENT.labels('outbox').inc()
+            mail.sent_date = timezone.now()
+            mail.save(update_fields=['sent_date'])
+            sent += 1
+    finally:
+        connection.close()
+
+    return sent, len(due) - sent
+
+
+def claim(mails, now):
+    """This function claims the given mails for MAIL_QUEUE_LEASE seconds and returns the claimed ones.
+
+    Every mail is claimed by an UPDATE that counts the attempt and moves its next attempt to the end of the lease,
+    which only matches while the next attempt is still the one that was read. A mail claimed by another run in the
+    meantime is skipped. A run that dies while sending leaves its mails to be tried again after the lease.
+    """
+    lease = now + timedelta(seconds=settings.MAIL_QUEUE_LEASE)
+    claimed = []
+    for mail in mails:
+        if OutgoingMail.objects.db_manager(routers.PRIMARY).filter(pk=mail.pk, sent_date=None, next_attempt_date=mail.next_attempt_date) \
+                .update(attempts=F('attempts') + 1, next_attempt_date=lease):
+            mail.attempts += 1
+            mail.next_attempt_date = lease
+            claimed.append(mail)
+    return claimed
+
+
+def is_permanent(error):
+    """This function checks whether sending a mail failed in a way that will not change by retrying it:
+    the server rejected it with a 5xx reply, or the mail itself is invalid.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return not isinstance(error, (smtplib.SMTPException, OSError))
+
+
+def is_alive(connection):
+    """This function checks whether the SMTP connection of a mail backend still answers.
+    """
+    try:
+        return connection.connection is not None and connection.connection.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def failed(mail, error, permanent=False):
+    """This function records a failed attempt to send a claimed mail and schedules the next one.
+    A permanent failure uses up all attempts, so the mail is not tried again.
+    """
+    if permanent:
+        logger.warning("Sending mail %d failed permanently: %s", mail.pk, error)
+    else:
+        logger.warning("Sending mail %d failed: %s", mail.pk, error)
+    metrics.MAIL_FAILURES.labels('outbox').inc()
+    if permanent:
+        # the attempt itself was counted by claim()
+        mail.attempts = max(mail.attempts, settings.MAIL_QUEUE_MAX_ATTEMPTS)
+    mail.last_error = str(error)
+    mail.next_attempt_date = timezone.now() + timedelta(seconds=settings.MAIL_QUEUE_RETRY_DELAY * 2 ** (mail.attempts - 1))
+    mail.save(update_fields=['attempts', 'last_error', 'next_attempt_date'])
@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
+
+from . import search
+
+
+class KeysetPage:
+    """This class represents one page of a keyset (cursor) paginated list.
+
+    Attributes:
+        object_list: The objects on this page
+        has_next: A boolean value whether a following page exists
+        has_previous: A boolean value whether a preceding page exists
+        next_cursor: The cursor pointing behind the last object of this page
+        previous_cursor: The cursor pointing before the first object of this page
+    """
+
+    def __init__(self, object_list, has_next, has_previous, cursor_field):
+        self.object_list = object_list
+        self.has_next = has_next and bool(object_list)
+        self.has_previous = has_previous and bool(object_list)
+        self.next_cursor = encode_cursor(object_list[-1], cursor_field) if self.has_next else ''
+        self.previous_cursor = encode_cursor(object_list[0], cursor_field) if self.has_previous else ''
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(obj, cursor_field):
+    """This function builds the cursor string ("<value>.<pk>") for a given object.
+    """
+    value = getattr(obj, cursor_field)
+    value = value.isoformat() if hasattr(value, 'isoformat') else value
+    return '%s.%d' % (value, obj.pk)
+
+
+def decode_cursor(cursor, queryset, cursor_field):
+    """This function parses a cursor string into a (value, pk) tuple, or returns None if it is invalid.
+    """
+    value, _, pk = cursor.rpartition('.')
+    if cursor_field in queryset.query.annotations:
+        field = queryset.query.annotations[cursor_field].output_field
+    else:
+        field = queryset.model._meta.get_field(cursor_field)
+    try:
+        return field.to_python(value), int(pk)
+    except (ValidationError, ValueError):
+        return None
+
+
+def comment_page(comments, cursor):
+    """This function returns the newest COMMENTS_PAGE_SIZE comments older than the cursor (all if it is empty or invalid),
+    oldest first, and the cursor pointing before the first of them, or '' if there are no older comments.
+    The comments are fetched newest first with a single query over the index on (comment_task, comment_date).
+    """
+    page_size = settings.COMMENTS_PAGE_SIZE
+    before = decode_cursor(cursor, comments, 'comment_date') if cursor else None
+    if before:
+        value, pk = before
+        comments = comments.filter(Q(comment_date__lt=value) | Q(comment_date=value, pk__lt=pk), comment_date__lte=value)
+
+    comment_list = list(comments.order_by('-comment_date', '-pk')[:page_size + 1])
+    has_more = len(comment_list) > page_size
+    comment_list = comment_list[:page_size]
+    comment_list.reverse()
+    return comment_list, encode_cursor(comment_list[0], 'comment_date') if has_more else ''
+
+
+class KeysetPaginationMixin:
+    """This mixin replaces the OFFSET based pagination of a ListView by keyset pagination on (cursor_field, id).
+
+    Every page is fetched with a single index friendly range query, so deep pages cost the same as the first one.
+    The cursors are passed as the GET parameters "after" and "before", the ordering as the GET parameter "sort".
+
+    Attributes:
+        cursor_field: The name of the field the list is ordered by (ties are broken by the primary key)
+        orderings: The other fields the list can be ordered by, by the value of the GET parameter "sort";
+            a leading "-" orders descending
+    """
+    cursor_field = 'finished_date'
+    orderings = {'activity': '-last_activity_at'}
+
+    def get_cursor_field(self, queryset):
+        """This function returns the field the given queryset is paginated by, with a leading "-" if descending.
+        Ranked search results are paginated by their relevance instead of cursor_field, unless another ordering is chosen.
+        """
+        sort = self.request.GET.get('sort', '')
+        if sort in self.orderings:
+            return self.orderings[sort]
+        if search.SEARCH_RANK in queryset.query.annotations:
+            return search.SEARCH_RANK
+        return self.cursor_field
+
+    def get_paginate_by(self, queryset):
+        """This function returns the number of tasks shown per page.
+        """
+        return settings.TASKS_PAGE_SIZE
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        sort = self.request.GET.get('sort', '')
+        context['sort'] = sort if sort in self.orderings else ''
+        return context
+
+    def paginate_queryset(self, queryset, page_size):
+        """This function returns the page selected by the cursor in the request.
+        """
+        field = self.get_cursor_field(queryset)
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        # the comparisons selecting the rows following and preceding the cursor
+        ahead, behind = ('lt', 'gt') if descending else ('gt', 'lt')
+        after = decode_cursor(self.request.GET.get('after', ''), queryset, field)
+        before = None if after else decode_cursor(self.request.GET.get('before', ''), queryset, field)
+
+        # the redundant bound on the field lets the database seek into the index instead of scanning it
+        if after:
+            value, pk = after
+            queryset = queryset.filter(Q(**{field + '__' + ahead: value}) | Q(**{field: value, 'pk__' + ahead: pk}),
+                                       **{field + '__' + ahead + 'e': value})
+        elif before:
+            value, pk = before
+            queryset = queryset.filter(Q(**{field + '__' + behind: value}) | Q(**{field: value, 'pk__' + behind: pk}),
+                                       **{field + '__' + behind + 'e': value})
+
+        if bool(before) != descending:
+            queryset = queryset.order_by('-' + field, '-pk')
+        else:
+            queryset = queryset.order_by(field, 'pk')
+
+        # fetch one additional row to find out whether there is another page
+        object_list = list(queryset[:page_size + 1])
+        has_more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+
+        if before:
+            object_list.reverse()
+            page = KeysetPage(object_list, True, has_more, field)
+        else:
+            page = KeysetPage(object_list, has_more, after is not None, field)
+
+        return (None, page, page.object_list, page.has_other_pages())
+
+
+class IdCursorPagination(CursorPagination):
+    """This pagination returns the pages of an API list ordered by id, linked by opaque cursors (see tasks/api.py).
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
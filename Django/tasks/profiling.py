@@ -0,0 +1,105 @@
+"""Profiling of single requests (see ProfilerMiddleware) and of commands (see the profile command).
+
+Every profile is written to PROFILE_DIR twice: as <name>.pstats, which can be read with the pstats
+module or e.g. snakeviz, and as <name>.collapsed.txt with one "frame;frame;frame microseconds"
+line per call stack, which flamegraph.pl or speedscope turn into a flame graph. When the files in
+PROFILE_DIR grow beyond PROFILE_DIR_MAX_BYTES, the oldest ones are deleted.
+
+cProfile only records which function called which, not whole stacks. The stacks are therefore
+reconstructed from the call graph, splitting the time of a function among its callers in
+proportion to the time it spent on behalf of each of them.
+"""
+import cProfile
+import os
+import pstats
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.conf import settings
+
+# stacks taking less than this many microseconds are left out of the collapsed stacks
+MIN_MICROSECONDS = 1
+
+MAX_DEPTH = 200
+
+
+def profile_call(func, *args, **kwargs):
+    """This function calls func under cProfile and returns its result and the profile.
+    """
+    profile = cProfile.Profile()
+    result = profile.runcall(func, *args, **kwargs)
+    return result, profile
+
+
+def frame_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # a builtin, e.g. "<method 'join' of 'str' objects>"
+        return name.replace(';', ',')
+    return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+
+def collapsed_stacks(stats):
+    """This function returns the collapsed stacks of a pstats.Stats object as a Counter of "frame;frame;frame" to microseconds.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+
+    stacks = Counter()
+
+    def walk(func, path, share):
+        # share is the part of the time of func that was spent on the given path
+        path = path + [func]
+        own = stats.stats[func][2]
+        if own * share * 1e6 >= MIN_MICROSECONDS:
+            stacks[';'.join(frame_name(frame) for frame in path)] += int(own * share * 1e6)
+        if len(path) >= MAX_DEPTH:
+            return
+        for callee, via in callees[func].items():
+            total = stats.stats[callee][3]
+            # recursion is cut off at the first repetition of a function
+            if total and callee not in path and via * share * 1e6 >= MIN_MICROSECONDS:
+                walk(callee, path, share * via / total)
+
+    for root in [func for func, value in stats.stats.items() if not value[4]]:
+        walk(root, [], 1.0)
+    return stacks
+
+
+def save(profile, name):
+    """This function writes a profile to PROFILE_DIR (see the module documentation) and returns the path without the extension.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(settings.PROFILE_DIR, '%s-%s-%d' % (datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+                                                            re.sub(r'[^\w.-]+', '_', name), os.getpid()))
+    profile.dump_stats(base + '.pstats')
+    stacks = collapsed_stacks(pstats.Stats(profile))
+    with open(base + '.collapsed.txt', 'w') as f:
+        for stack, microseconds in sorted(stacks.items()):
+            f.write('%s %d\n' % (stack, microseconds))
+    rotate()
+    return base
+
+
+def rotate():
+    """This function deletes the oldest files of PROFILE_DIR until they take at most PROFILE_DIR_MAX_BYTES.
+    """
+    files = []
+    for entry in os.scandir(settings.PROFILE_DIR):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, _, size, _ in files)
+    for _, _, size, path in files:
+        if total <= settings.PROFILE_DIR_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by another process
+            pass
+        total -= size
@@ -0,0 +1,136 @@
+"""Parsing and importing of meeting protocols.
+
+A topic starts with a line "#### <topic>", a TODO is written as "TODO <user>, <user>: <task>".
+The parser works on any iterable of lines (a pasted text, an uploaded file, a file on disk), so a
+protocol never has to be held in memory as a whole.
+"""
+import codecs
+import io
+from collections import namedtuple
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import bulk, metrics
+from .models import Task
+
+# a topic of the protocol
+Topic = namedtuple('Topic', ['title'])
+
+# a TODO of the protocol; users is the text naming the assignees, topic the Topic it belongs to
+Todo = namedtuple('Todo', ['topic', 'users', 'text'])
+
+# number of TODOs inserted per bulk operation
+BATCH_SIZE = 500
+
+
+def text_lines(text):
+    """This function iterates over the lines of a text without splitting it into a list.
+    """
+    return io.StringIO(text)
+
+
+def file_lines(upload, encoding='utf-8', errors='strict'):
+    """This function iterates over the decoded lines of an uploaded file, which is read in chunks.
+    """
+    return codecs.iterdecode(upload, encoding, errors)
+
+
+def file_todos(upload, encoding=None):
+    """This function returns the TODOs of an uploaded protocol file. A file that is not valid UTF-8 (e.g. saved
+    as Latin-1 or Windows-1252 by an older editor) is read again as Windows-1252, whose few undefined bytes are replaced.
+    A given encoding (e.g. the charset named by the server of a fetched protocol) is used strictly instead.
+    """
+    if encoding:
+        return list(todos(file_lines(upload, encoding)))
+    try:
+        return list(todos(file_lines(upload)))
+    except UnicodeDecodeError:
+        upload.seek(0)
+        return list(todos(file_lines(upload, 'cp1252', 'replace')))
+
+
+def parse(lines):
+    """This generator yields a Topic for every topic and a Todo for every TODO found in the given lines.
+    """
+    topic = Topic("")
+    for row in lines:
+        row = row.rstrip('\r\n')
+        #depricated for etherpad: if row.startswith('* '):
+
+        # if a new topic starts
+        if row.startswith('#### '):
+            topic = Topic(row[5:])
+            yield topic
+
+        if 'TODO' in row:
+            todo = row[row.find('TODO'):]
+            if ':' in todo:
+                users, text = todo.split(':', 1)
+                yield Todo(topic, users[5:], text)
+
+
+def todos(lines):
+    """This generator yields only the TODOs found in the given lines.
+    """
+    return (item for item in parse(lines) if isinstance(item, Todo))
+
+
+def user_names(todo):
+    """This function returns the lower case user names a TODO is assigned to.
+    """
+    return [x.strip().lower() for x in todo.users.split(",") if x.strip()]
+
+
+def import_todos(todos):
+    """This function creates a task for every given TODO and assigns it to the named users.
+
+    All tasks and assignments are inserted with bulk operations (BATCH_SIZE TODOs each) inside a single transaction.
+    Returns the list of created tasks and the sorted list of user names that do not exist.
+    """
+    now = timezone.now()
+    created = []
+    unknown_users = set()
+    todos = iter(todos)
+
+    with transaction.atomic():
+        while True:
+            batch = [todo for _, todo in zip(range(BATCH_SIZE), todos)]
+            if not batch:
+                break
+            names = [user_names(todo) for todo in batch]
+            users = {user.username: user for user in User.objects.filter(username__in={name for row in names for name in row})}
+            unknown_users.update(name for row in names for name in row if name not in users)
+
+            tasks = bulk.create_tasks([Task(task_text=todo.text,
+                                            task_description='zum Thema in der Sitzung: '+todo.topic.title,
+                                            finished_date=(now + timedelta(days=7)),
+                                            creation_date=now,
+                                            is_finished=False,
+                                            important=False)
+                                       for todo in batch])
+            bulk.add_relations('assignedTo', [(task.pk, users[name].pk)
+                                              for task, row in zip(tasks, names)
+                                              for name in sorted(set(row)) if name in users])
+            created += tasks
+
+    metrics.PROTOCOL_IMPORT_TODOS.observe(len(created))
+    metrics.PROTOCOL_UNKNOWN_USERS.inc(len(unknown_users))
+    return created, sorted(unknown_users)
+
+
+def mail_body(todos):
+    """This function renders the notification mail about the given TODOs, grouped by their topics.
+    """
+    email_content = ["Heyho,\n\nin der Sitzung wurden neue Aufgaben verteilt.\n\n"]
+    topic = None
+    for todo in todos:
+        if todo.topic is not topic:
+            # create e-mail subheader based on topics for TODOs
+            topic = todo.topic
+            email_content.append("Thema in der Sitzung: " + topic.title + "\n")
+        email_content.append("  TODO:          " + todo.text + "\n  Beauftragte(r): " + todo.users + "\n\n")
+    email_content.append("Euch noch ein frohes Schaffen\nFrudo")
+    return "".join(email_content)
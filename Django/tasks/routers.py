@@ -0,0 +1,87 @@
+"""Routing of reads to replicas of the database.
+
+Every alias in DATABASE_REPLICA_ALIASES (built from DATABASE_REPLICAS in settings.py, e.g.
+DATABASE_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3) is a read-only copy of the default
+database. Reads are spread over the replicas, writes go to the default database.
+
+A replica may lag behind, so the thread is pinned to the default database after its first write
+and for the rest of a request that is not a GET or HEAD request. ReplicaPinningMiddleware (see
+tasks/middleware.py) also keeps a client on the default database for REPLICA_PIN_SECONDS after
+it wrote, so that e.g. the page a form redirects to shows the new data.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+
+_state = threading.local()
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def pin(pinned=True):
+    """This function routes (or stops routing) all reads of the current thread to the default database.
+    """
+    _state.pinned = pinned
+
+
+def has_written():
+    return getattr(_state, 'written', False)
+
+
+def reset():
+    """This function forgets the pinning and the writes of the current thread, e.g. at the end of a request.
+    """
+    _state.pinned = False
+    _state.written = False
+
+
+@contextmanager
+def primary():
+    """This context manager routes all reads inside it to the default database.
+    """
+    pinned = is_pinned()
+    pin()
+    try:
+        yield
+    finally:
+        pin(pinned)
+
+
+def replicas():
+    """This function returns the aliases of the replicas, leaving out those that are the default database itself.
+    The latter happens in tests, where the replicas mirror the test database (see TEST MIRROR in settings.py).
+    """
+    primary = connections[PRIMARY].settings_dict
+    key = lambda settings_dict: (settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'])
+    return [alias for alias in settings.DATABASE_REPLICA_ALIASES if key(connections[alias].settings_dict) != key(primary)]
+
+
+class ReplicaRouter:
+    """This router sends reads to a random replica unless the thread is pinned, and everything else to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if is_pinned():
+            return PRIMARY
+        return random.choice(replicas() or [PRIMARY])
+
+    def db_for_write(self, model, **hints):
+        # from now on this thread has to read its own writes
+        _state.written = True
+        pin()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # all databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get their schema from the default database
+        return db not in settings.DATABASE_REPLICA_ALIASES
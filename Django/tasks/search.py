@@ -0,0 +1,96 @@
+"""Full-text search over tasks.
+
+On SQLite the titles, descriptions and comments of all tasks are kept in the FTS5 virtual table
+tasks_task_fts (its rowid is the id of the task), which is created by migration 0014 and kept in
+sync by the signal handlers in tasks/signals.py. Other databases fall back to a substring filter.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Task, Comment
+
+FTS_TABLE = 'tasks_task_fts'
+
+# name of the annotation holding the relevance of a search result (smaller is better)
+SEARCH_RANK = 'search_rank'
+
+
+def is_enabled():
+    """This function checks whether the full-text index is available on the current database.
+    """
+    return connection.vendor == 'sqlite'
+
+
+def to_match_query(text):
+    """This function turns free text from the search box into a FTS5 query in which every word is a prefix.
+    """
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', text))
+
+
+def search(queryset, text):
+    """This function restricts a task queryset to the tasks matching the given search text.
+
+    The matching tasks are annotated with their relevance (SEARCH_RANK) and ordered by it.
+    An empty search text leaves the queryset unchanged.
+    """
+    query = to_match_query(text)
+    if not query:
+        return queryset
+    if not is_enabled():
+        return queryset.filter(Q(task_text__icontains=text) | Q(task_description__icontains=text))
+
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=['%s.rowid = %s.id' % (FTS_TABLE, Task._meta.db_table), '%s MATCH %%s' % FTS_TABLE],
+        params=[query],
+    ).annotate(**{SEARCH_RANK: RawSQL('%s.rank' % FTS_TABLE, (), output_field=FloatField())}).order_by(SEARCH_RANK, 'id')
+
+
+def index_tasks(task_ids):
+    """This function (re)builds the index entries of the given tasks from the database.
+    """
+    if not is_enabled():
+        return
+    task_ids = list(task_ids)
+    with connection.cursor() as cursor:
+        # stay below the SQLite limit of 999 query parameters
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, placeholders), chunk)
+            cursor.execute(_INSERT_SQL + ' WHERE t.id IN (%s)' % placeholders, chunk)
+
+
+def remove_task(task_id):
+    """This function removes a deleted task from the index.
+    """
+    if not is_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [task_id])
+
+
+def rebuild_index():
+    """This function empties the index and fills it again from all tasks and comments.
+
+    Returns the number of indexed tasks.
+    """
+    if not is_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(_INSERT_SQL)
+        cursor.execute("INSERT INTO %s(%s) VALUES('optimize')" % (FTS_TABLE, FTS_TABLE))
+        cursor.execute('SELECT count(*) FROM %s' % FTS_TABLE)
+        return cursor.fetchone()[0]
+
+
+_INSERT_SQL = (
+    'INSERT INTO {fts}(rowid, task_text, task_description, comment_text) '
+    'SELECT t.id, t.task_text, t.task_description, '
+    "(SELECT group_concat(c.comment_text, ' ') FROM {comment} c WHERE c.comment_task_id = t.id) "
+    'FROM {task} t'
+).format(fts=FTS_TABLE, task=Task._meta.db_table, comment=Comment._meta.db_table)
@@ -0,0 +1,164 @@
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import bulk
+from .models import Comment, Label, Task, task_update_fields
+
+
+def requested_fields(request):
+    """This function returns the set of fields listed in the fields query parameter of a GET request, or None if all fields are wanted.
+    """
+    if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',')}
+
+
+class SparseFieldsMixin:
+    """This mixin leaves out all fields of the serializer that are not listed in the fields query parameter (e.g. ?fields=id,task_text).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class UsernameListField(serializers.Field):
+    """This field represents the users of a many-to-many relation as a list of user names.
+    """
+
+    def to_representation(self, value):
+        # .all() uses the prefetched users
+        return [user.username for user in value.all()]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not all(isinstance(name, str) for name in data):
+            raise serializers.ValidationError("Expected a list of user names.")
+        return data
+
+
+class PrimaryKeyListField(serializers.Field):
+    """This field represents the objects of a many-to-many relation as a list of primary keys.
+    """
+
+    def to_representation(self, value):
+        return [obj.pk for obj in value.all()]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in data):
+            raise serializers.ValidationError("Expected a list of ids.")
+        return data
+
+
+def resolve_relations(items):
+    """This function replaces the user names of validated tasks by the ids of the users and checks that their labels exist.
+
+    All tasks are checked with one query for the users and one for the labels.
+    Raises a ValidationError listing the unknown users and labels.
+    """
+    names = {name for item in items for name in item.get('assignedTo', ())}
+    label_ids = {pk for item in items for pk in item.get('labels', ())}
+    users = dict(User.objects.filter(username__in=names).values_list('username', 'pk')) if names else {}
+    labels = set(Label.objects.filter(pk__in=label_ids).values_list('pk', flat=True)) if label_ids else set()
+
+    errors = {}
+    if names - set(users):
+        errors['assignedTo'] = ["Unknown users: %s" % ", ".join(sorted(names - set(users)))]
+    if label_ids - labels:
+        errors['labels'] = ["Unknown labels: %s" % ", ".join(str(pk) for pk in sorted(label_ids - labels))]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    for item in items:
+        if 'assignedTo' in item:
+            item['assignedTo'] = sorted({users[name] for name in item['assignedTo']})
+        if 'labels' in item:
+            item['labels'] = sorted(set(item['labels']))
+    return items
+
+
+class TaskListSerializer(serializers.ListSerializer):
+    """This serializer creates and updates many tasks at once with the set-based writes of tasks/bulk.py.
+
+    For an update the instance has to be the list of tasks in the order of the data.
+    """
+
+    def validate(self, attrs):
+        return resolve_relations(attrs)
+
+    def create(self, validated_data):
+        now = timezone.now()
+        tasks = bulk.create_tasks([Task(creation_date=now, **self.scalar_fields(attrs)) for attrs in validated_data])
+        for field_name in ('assignedTo', 'labels'):
+            bulk.add_relations(field_name, [(task.pk, pk) for task, attrs in zip(tasks, validated_data) for pk in attrs.get(field_name, ())])
+        return tasks
+
+    def update(self, instance, validated_data):
+        fields = set()
+        for task, attrs in zip(instance, validated_data):
+            for name, value in self.scalar_fields(attrs).items():
+                setattr(task, name, value)
+                fields.add(name)
+        if fields:
+            bulk.update_tasks(instance, sorted(fields))
+        for field_name in ('assignedTo', 'labels'):
+            changed = [(task, attrs[field_name]) for task, attrs in zip(instance, validated_data) if field_name in attrs]
+            if changed:
+                bulk.set_relations(field_name, [task.pk for task, _ in changed], [(task.pk, pk) for task, pks in changed for pk in pks])
+        return instance
+
+    @staticmethod
+    def scalar_fields(attrs):
+        return {name: value for name, value in attrs.items() if name not in ('assignedTo', 'labels')}
+
+
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    assignedTo = UsernameListField(required=False)
+    labels = PrimaryKeyListField(required=False)
+
+    class Meta:
+        model = Task
+        fields = ('id', 'task_text', 'task_description', 'finished_date', 'creation_date', 'updated_at',
+                  'is_finished', 'important', 'assignedTo', 'labels', 'comment_count', 'last_activity_at')
+        read_only_fields = ('creation_date', 'updated_at', 'comment_count', 'last_activity_at')
+        extra_kwargs = {'important': {'default': False}}
+        list_serializer_class = TaskListSerializer
+
+    def validate(self, attrs):
+        # the tasks of a bulk request are resolved together by TaskListSerializer
+        if self.parent is None:
+            resolve_relations([attrs])
+        return attrs
+
+    def create(self, validated_data):
+        validated_data['creation_date'] = timezone.now()
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        relations = {name: validated_data.pop(name) for name in ('assignedTo', 'labels') if name in validated_data}
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        # the comment stats of the task may have changed since it was loaded
+        instance.save(update_fields=task_update_fields(validated_data))
+        for name, pks in relations.items():
+            getattr(instance, name).set(pks)
+        return instance
+
+
+class LabelSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Label
+        fields = ('id', 'label_text', 'label_description', 'label_color')
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    comment_user = serializers.SlugRelatedField(slug_field='username', read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ('id', 'comment_task', 'comment_user', 'comment_date', 'comment_text')
+        read_only_fields = ('comment_date',)
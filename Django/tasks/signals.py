@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import bulk, fragments, search
+from .models import Task, Comment, Label, deleting_tasks
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """This function applies SQLITE_PRAGMAS to every new SQLite connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+@receiver(post_save, sender=Task)
+def index_task(sender, instance, **kwargs):
+    """This function updates the search index entry and the cached row of a task after it was saved.
+    """
+    search.index_tasks([instance.pk])
+    fragments.invalidate([instance.pk])
+
+@receiver(pre_delete, sender=Task)
+def task_deleting(sender, instance, **kwargs):
+    """This function notes a task that is about to be deleted together with its comments.
+    Task.delete() and the delete() of its querysets forget the noted tasks when they are done.
+    """
+    deleting_tasks().add(instance.pk)
+
+@receiver(post_delete, sender=Task)
+def unindex_task(sender, instance, **kwargs):
+    """This function removes a deleted task from the search index.
+    """
+    search.remove_task(instance.pk)
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    """This function updates the search index entry, the cached row and the modification date of the task a comment belongs to.
+    A new comment also increments the number of comments of the task and may be its latest activity.
+    The single UPDATE computes the new values in the database, so concurrent comments are all counted.
+    """
+    search.index_tasks([instance.comment_task_id])
+    fragments.invalidate([instance.comment_task_id])
+    if created:
+        Task.objects.filter(pk=instance.comment_task_id).update(
+            comment_count=F('comment_count') + 1, updated_at=timezone.now(),
+            last_activity_at=Greatest('last_activity_at', Value(instance.comment_date, output_field=DateTimeField())))
+    else:
+        touch([instance.comment_task_id])
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """This function updates the search index entry, the cached row and the modification date of the task a comment belonged to.
+    The number of comments is decremented and the latest activity recomputed from the remaining comments in a single UPDATE.
+    Nothing is done for the comments deleted together with their task.
+    """
+    if instance.comment_task_id in deleting_tasks():
+        return
+    search.index_tasks([instance.comment_task_id])
+    fragments.invalidate([instance.comment_task_id])
+    Task.objects.filter(pk=instance.comment_task_id).update(
+        comment_count=F('comment_count') - 1, updated_at=timezone.now(),
+        last_activity_at=bulk.comment_stats()['last_activity_at'])
+
+@receiver(m2m_changed, sender=Task.assignedTo.through)
+@receiver(m2m_changed, sender=Task.labels.through)
+def task_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """This function marks tasks whose assignees or labels were changed as changed.
+    """
+    if action in ('post_add', 'post_remove'):
+        task_changed(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        # the tasks are unknown after the relations are cleared
+        task_changed(related_task_ids(sender, instance))
+    elif action == 'post_clear' and not reverse:
+        task_changed([instance.pk])
+
+@receiver(post_save, sender=Label)
+@receiver(pre_delete, sender=Label)
+def label_changed(sender, instance, **kwargs):
+    """This function marks all tasks with a changed or deleted label as changed.
+    """
+    task_changed(related_task_ids(Task.labels.through, instance))
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """This function marks all tasks assigned to a renamed or deleted user as changed.
+    Saves which do not touch the username (e.g. of last_login on every login) are ignored.
+    """
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    task_changed(related_task_ids(Task.assignedTo.through, instance))
+
+
+def task_changed(task_ids):
+    """This function marks tasks as changed whose related objects were changed.
+    """
+    task_ids = list(task_ids)
+    if task_ids:
+        fragments.invalidate(task_ids)
+        touch(task_ids)
+
+def touch(task_ids):
+    """This function sets the modification date (updated_at) of the given tasks to now.
+    """
+    Task.objects.filter(pk__in=task_ids).update(updated_at=timezone.now())
+
+def related_task_ids(through, instance):
+    """This function returns the ids of the tasks related to a label or user through the given M2M table.
+    """
+    field = 'label' if isinstance(instance, Label) else 'user'
+    return list(through.objects.filter(**{field: instance}).values_list('task_id', flat=True))
@@ -0,0 +1,10 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """This storage names the collected static files after the hash of their content and adds a .gz (and with the brotli
+    package a .br) file next to each of them, which WhiteNoiseMiddleware serves to clients accepting that encoding.
+
+    The names change with every change of a file, so WhiteNoiseMiddleware lets browsers cache them forever.
+    Like ManifestStaticFilesStorage, it needs collectstatic to have been run unless DEBUG is on.
+    """
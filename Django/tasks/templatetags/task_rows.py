@@ -0,0 +1,36 @@
+from django import template
+
+from tasks import fragments
+
+register = template.Library()
+
+
+class TaskRowNode(template.Node):
+
+    def __init__(self, task, nodelist):
+        self.task = task
+        self.nodelist = nodelist
+
+    def render(self, context):
+        task = self.task.resolve(context)
+        cached_row = getattr(task, 'cached_row', None)
+        if cached_row is not None:
+            return cached_row
+        html = self.nodelist.render(context)
+        if hasattr(task, 'row_key'):
+            fragments.store_row(task, html)
+        return html
+
+
+@register.tag
+def task_row(parser, token):
+    """This tag renders the row of a task in a task list, or returns it from the cache (see tasks/fragments.py).
+
+    Usage: {% task_row task %} ... {% endtask_row %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("'%s' takes exactly one argument (a task)" % bits[0])
+    nodelist = parser.parse(('endtask_row',))
+    parser.delete_first_token()
+    return TaskRowNode(parser.compile_filter(bits[1]), nodelist)
@@ -1,13 +1,56 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from django.urls import reverse
 from django.utils import timezone
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from datetime import timedelta
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from rest_framework.test import APIClient
+from unittest import mock, skipIf
+import json
+import logging
+import os
+import re
+import tempfile
+import socketserver
+import threading
 
-from .models import Task, Label
+try:
+    import ldap
+    from django_auth_ldap.config import LDAPSearch
+    from . import ldapauth
+except ImportError:
+    ldap = None
+
+from .forms import CreateTaskForm
+from .models import Task, Label, Comment, OutgoingMail, deleting_tasks
+from .serializers import TaskSerializer
+from . import benchmark, digest, fragments, metrics, middleware, outbox, profiling, protocol, routers, search
 
 # Create your tests here.
 
+# the hashed names need the manifest written by collectstatic (see StaticFilesTests)
+plain_static_files = override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+
+def setUpModule():
+    # the line logged for every request (see RequestMetricsTests)
+    logging.getLogger('tasks.metrics').setLevel(logging.CRITICAL)
+    plain_static_files.enable()
+
+def tearDownModule():
+    plain_static_files.disable()
+
 def create_task(task_text, task_description, finished_date, creation_date, is_finished, important):
     return Task.objects.create(task_text=task_text, task_description=task_description, finished_date=finished_date, creation_date=creation_date, is_finished=is_finished, important=important)
 
@@ -33,3 +76,1642 @@ class CreateTaskTests(TestCase):
             response.context['tasks_list'],
             ['<Task: test>']
         )
+
+class TaskListQueryTests(TestCase):
+
+    # user (the session is cached), version (see ConditionalGetMixin), tasks, assignees, labels
+    LIST_QUERIES = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.label = create_label("label", "a label", "#000000")
+        self.client.login(username='user1', password='12345')
+
+    def create_tasks(self, count, is_finished):
+        time = timezone.now()
+        for i in range(count):
+            task = create_task("task %d" % i, "testi", time, time, is_finished, False)
+            task.assignedTo.add(self.user)
+            task.labels.add(self.label)
+
+    def test_open_tasks_constant_queries(self):
+        self.create_tasks(1, False)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            self.client.get(reverse('tasks:index'))
+        self.create_tasks(10, False)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get(reverse('tasks:index'))
+        self.assertEqual(len(response.context['tasks_list']), 11)
+
+    def test_closed_tasks_constant_queries(self):
+        self.create_tasks(1, True)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            self.client.get(reverse('tasks:closedTasks'))
+        self.create_tasks(10, True)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get(reverse('tasks:closedTasks'))
+        self.assertEqual(len(response.context['tasks_list']), 11)
+
+@override_settings(TASKS_PAGE_SIZE=2)
+class TaskListPaginationTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        # two tasks share a due date so that the id is needed to break the tie
+        self.tasks = [create_task("task %d" % i, "testi", time.date() + timedelta(days=i // 2), time, False, False) for i in range(5)]
+
+    def test_walk_pages_forward_and_back(self):
+        response = self.client.get(reverse('tasks:index'))
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[0:2])
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+        response = self.client.get(reverse('tasks:index'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[2:4])
+
+        response = self.client.get(reverse('tasks:index'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[4:5])
+        self.assertFalse(response.context['page_obj'].has_next)
+
+        response = self.client.get(reverse('tasks:index'), {'before': response.context['page_obj'].previous_cursor})
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[2:4])
+        self.assertTrue(response.context['page_obj'].has_previous)
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse('tasks:index'), {'after': 'garbage'})
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[0:2])
+
+    def test_deep_page_constant_queries(self):
+        last = self.tasks[-2]
+        with self.assertNumQueries(TaskListQueryTests.LIST_QUERIES):
+            response = self.client.get(reverse('tasks:index'), {'after': '%s.%d' % (last.finished_date.isoformat(), last.id)})
+        self.assertEqual(list(response.context['tasks_list']), self.tasks[4:5])
+
+class CommentStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        self.time = timezone.now() - timedelta(days=10)
+        self.task = create_task("task", "testi", self.time, self.time, False, False)
+
+    def comment(self, days):
+        return Comment.objects.create(comment_text="comment", comment_user=self.user, comment_task=self.task,
+                                      comment_date=self.time + timedelta(days=days))
+
+    def stats(self):
+        self.task.refresh_from_db()
+        return self.task.comment_count, self.task.last_activity_at
+
+    def test_comments_update_counts(self):
+        self.assertEqual(self.stats(), (0, self.time))
+        first = self.comment(2)
+        second = self.comment(1)
+        self.assertEqual(self.stats(), (2, self.time + timedelta(days=2)))
+        first.delete()
+        self.assertEqual(self.stats(), (1, self.time + timedelta(days=1)))
+        second.delete()
+        self.assertEqual(self.stats(), (0, self.time))
+
+    def test_editing_a_loaded_task_keeps_counts(self):
+        label = create_label("label", "a label", "#000000")
+        clean = CreateTaskForm.clean
+
+        def comment_meanwhile(form):
+            # the task was loaded by the view before
+            self.comment(1)
+            return clean(form)
+
+        with mock.patch.object(CreateTaskForm, 'clean', comment_meanwhile):
+            response = self.client.post(reverse('tasks:edit', args=(self.task.pk,)), {
+                'task_text': "renamed", 'task_description': "testi", 'finished_date': timezone.now().date().isoformat(),
+                'assignedTo': [self.user.pk], 'labels': [label.pk]})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+        self.assertEqual(self.stats(), (1, self.time + timedelta(days=1)))
+        self.assertEqual(self.task.task_text, "renamed")
+        self.assertEqual(list(self.task.labels.all()), [label])
+        self.assertEqual(list(self.task.assignedTo.all()), [self.user])
+
+    def test_api_update_keeps_counts(self):
+        validate = TaskSerializer.validate
+
+        def comment_meanwhile(serializer, attrs):
+            self.comment(1)
+            return validate(serializer, attrs)
+
+        with mock.patch.object(TaskSerializer, 'validate', comment_meanwhile):
+            response = self.client.patch('/api/tasks/%d/' % self.task.pk, json.dumps({'task_text': "renamed", 'assignedTo': ['user1']}),
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats(), (1, self.time + timedelta(days=1)))
+        self.assertEqual(list(self.task.assignedTo.all()), [self.user])
+
+    def test_save_keeps_django_semantics(self):
+        task = Task.objects.only('task_text').get(pk=self.task.pk)
+        task.task_text = "renamed"
+        with CaptureQueriesContext(connection) as queries:
+            task.save()
+        task_queries = [q['sql'] for q in queries.captured_queries if 'tasks_task"' in q['sql'] and 'tasks_task_fts' not in q['sql']]
+        # the deferred fields are neither loaded nor written
+        self.assertEqual(len(task_queries), 1)
+        self.assertNotIn('task_description', task_queries[0])
+
+        # a task whose row was deleted is inserted again
+        self.task.comment_count = 0
+        Task.objects.filter(pk=self.task.pk).delete()
+        self.task.save()
+        self.assertEqual(self.stats(), (0, self.time))
+
+    def test_deleting_a_task_skips_its_comments(self):
+        for days in range(3):
+            self.comment(days)
+        with CaptureQueriesContext(connection) as queries:
+            self.task.delete()
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "tasks_task"')])
+        self.assertFalse(Comment.objects.exists())
+
+    def test_failed_deletion_is_forgotten(self):
+        comment = self.comment(1)
+        self.comment(2)
+        for delete in (self.task.delete, Task.objects.filter(pk=self.task.pk).delete):
+            with mock.patch.object(search, 'remove_task', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    delete()
+            self.assertEqual(deleting_tasks(), set())
+        comment.delete()
+        self.assertEqual(self.stats(), (1, self.time + timedelta(days=2)))
+
+    def test_list_shows_counts(self):
+        self.comment(1)
+        self.comment(2)
+        response = self.client.get(reverse('tasks:index'))
+        self.assertContains(response, "2 comments")
+        # the cached row is replaced
+        self.comment(3)
+        self.assertContains(self.client.get(reverse('tasks:index')), "3 comments")
+
+    @override_settings(TASKS_PAGE_SIZE=1)
+    def test_sort_by_activity(self):
+        older = create_task("older", "testi", self.time, self.time - timedelta(days=1), False, False)
+        newer = create_task("newer", "testi", self.time, self.time + timedelta(days=1), False, False)
+        self.comment(2)
+        url = reverse('tasks:index')
+        tasks = []
+        response = self.client.get(url, {'sort': 'activity'})
+        while True:
+            tasks += response.context['tasks_list']
+            if not response.context['page_obj'].has_next:
+                break
+            self.assertContains(response, "sort=activity&amp;after=")
+            with self.assertNumQueries(TaskListQueryTests.LIST_QUERIES):
+                response = self.client.get(url, {'sort': 'activity', 'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(tasks, [self.task, newer, older])
+        response = self.client.get(url, {'sort': 'activity', 'before': response.context['page_obj'].previous_cursor})
+        self.assertEqual(list(response.context['tasks_list']), [newer])
+
+    def test_repair_command(self):
+        self.comment(1)
+        other = create_task("other", "testi", self.time, self.time, False, False)
+        Task.objects.update(comment_count=5, last_activity_at=timezone.now())
+        out, err = StringIO(), StringIO()
+        call_command('repair_comment_stats', stdout=out, stderr=err)
+        self.assertEqual(out.getvalue().strip(), "Fixed 2 tasks.")
+        # the rows cached by the web server are not invalidated with the default cache
+        self.assertIn("local to every process", err.getvalue())
+        self.assertEqual(self.stats(), (1, self.time + timedelta(days=1)))
+        other.refresh_from_db()
+        self.assertEqual((other.comment_count, other.last_activity_at), (0, self.time))
+        out, err = StringIO(), StringIO()
+        call_command('repair_comment_stats', stdout=out, stderr=err)
+        self.assertEqual(out.getvalue().strip(), "Fixed 0 tasks.")
+        self.assertEqual(err.getvalue(), "")
+
+class TaskSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        self.beer = create_task("Bier kaufen", "fuer die Sitzung", time, time, False, False)
+        self.keys = create_task("Schluessel abholen", "beim Hausmeister", time, time, False, False)
+        self.party = create_task("Party planen", "Bier und Musik, Bier und Snacks", time, time, False, False)
+        self.closed = create_task("Bier entsorgen", "", time, time, True, False)
+
+    def search(self, text, url='tasks:index'):
+        response = self.client.get(reverse(url), {'filter': text})
+        return list(response.context['tasks_list'])
+
+    def test_matches_title_description_and_prefix(self):
+        self.assertEqual(set(self.search("bier")), {self.beer, self.party})
+        self.assertEqual(self.search("hausmeist"), [self.keys])
+        self.assertEqual(self.search("bier", 'tasks:closedTasks'), [self.closed])
+
+    def test_matches_comments_and_follows_changes(self):
+        comment = Comment.objects.create(comment_text="Drucker ist kaputt", comment_user=self.user, comment_task=self.keys, comment_date=timezone.now())
+        self.assertEqual(self.search("drucker"), [self.keys])
+        comment.delete()
+        self.assertEqual(self.search("drucker"), [])
+        self.keys.task_text = "Drucker reparieren"
+        self.keys.save()
+        self.assertEqual(self.search("drucker"), [self.keys])
+        self.keys.delete()
+        self.assertEqual(self.search("drucker"), [])
+
+    def test_results_are_ranked(self):
+        # "Bier" occurs twice in the description of the party task
+        self.assertEqual(self.search("bier"), [self.party, self.beer])
+
+    @override_settings(TASKS_PAGE_SIZE=1)
+    def test_ranked_results_are_paginated(self):
+        response = self.client.get(reverse('tasks:index'), {'filter': "bier"})
+        first = list(response.context['tasks_list'])
+        response = self.client.get(reverse('tasks:index'), {'filter': "bier", 'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(first + list(response.context['tasks_list']), [self.party, self.beer])
+        self.assertFalse(response.context['page_obj'].has_next)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM tasks_task_fts')
+        self.assertEqual(self.search("bier"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(set(self.search("bier")), {self.beer, self.party})
+
+class QueryPlanTests(TestCase):
+
+    def test_no_full_table_scans(self):
+        user = User.objects.create_user(username='user1', password='12345')
+        time = timezone.now()
+        for i in range(4):
+            task = create_task("task %d" % i, "testi", time, time, i % 2 == 0, False)
+            task.assignedTo.add(user)
+            Comment.objects.create(comment_text="comment", comment_user=user, comment_task=task, comment_date=time)
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+class DetailViewTests(TestCase):
+
+    # user, version (see ConditionalGetMixin), task, assignees, labels, newest comments with their authors
+    DETAIL_QUERIES = 6
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        self.task = create_task("test", "testi", time, time, False, False)
+        self.task.assignedTo.add(self.user)
+        self.task.labels.add(create_label("label", "a label", "#000000"))
+
+    def comment(self, count):
+        for i in range(count):
+            other = User.objects.create_user(username='commenter%d' % Comment.objects.count())
+            Comment.objects.create(comment_text="comment", comment_user=other, comment_task=self.task, comment_date=timezone.now())
+
+    def test_constant_queries(self):
+        self.comment(1)
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            self.client.get(reverse('tasks:detail', args=(self.task.id,)))
+        self.comment(5)
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            response = self.client.get(reverse('tasks:detail', args=(self.task.id,)))
+        self.assertEqual(len(response.context['comments']), 6)
+        self.assertEqual(list(response.context['members']), [self.user])
+
+    def test_post_comment_redirects(self):
+        url = reverse('tasks:detail', args=(self.task.id,))
+        response = self.client.post(url, {'comment_text': "hello"})
+        self.assertRedirects(response, url)
+        comment = Comment.objects.get()
+        self.assertEqual((comment.comment_text, comment.comment_user, comment.comment_task), ("hello", self.user, self.task))
+
+    def test_unknown_task(self):
+        response = self.client.get(reverse('tasks:detail', args=(self.task.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('tasks:comments', args=(self.task.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(COMMENTS_PAGE_SIZE=2)
+    def test_comment_pages(self):
+        self.comment(5)
+        comments = list(Comment.objects.order_by('comment_date', 'id'))
+        response = self.client.get(reverse('tasks:detail', args=(self.task.id,)))
+        self.assertEqual(response.context['comments'], comments[3:])
+        self.assertContains(response, "Show older comments")
+
+        url = reverse('tasks:comments', args=(self.task.id,))
+        # user, version (see ConditionalGetMixin), comments with their authors
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'before': response.context['older_comments']})
+        self.assertEqual(response.context['comments'], comments[1:3])
+        self.assertContains(response, "commenter2")
+        self.assertNotContains(response, "<html")
+
+        response = self.client.get(url, {'before': response.context['older_comments']}, HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual([comment['id'] for comment in data['comments']], [comments[0].id])
+        self.assertEqual(data['comments'][0]['comment_user'], "commenter0")
+        self.assertEqual(data['before'], '')
+
+    def test_comments_of_task_without_comments(self):
+        response = self.client.get(reverse('tasks:comments', args=(self.task.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['comments'], [])
+
+    def test_post_comment_from_script(self):
+        url = reverse('tasks:detail', args=(self.task.id,))
+        response = self.client.post(url, {'comment_text': "hello"}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, "hello", status_code=201)
+        self.assertNotContains(response, "<html", status_code=201)
+
+        response = self.client.post(url, {'comment_text': "again"}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['comment_text'], response.json()['comment_user']), ("again", "user1"))
+
+        response = self.client.post(url, {'comment_text': ""}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('comment_text', response.json()['errors'])
+        self.assertEqual(Comment.objects.count(), 2)
+
+PROTOCOL = """#### Begruessung
+Alle sind da.
+#### Getraenke
+TODO user1, Gast: Bier kaufen
+TODO USER2 , user1: Cola kaufen
+#### Sonstiges
+Nichts.
+"""
+
+class ProtocolParseTests(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='12345')
+        self.user2 = User.objects.create_user(username='user2', password='12345')
+        self.client.login(username='user1', password='12345')
+
+    def test_import(self):
+        response = self.client.post(reverse('tasks:protocolParse'), {'protocol_text': PROTOCOL}, follow=True)
+        self.assertRedirects(response, reverse('tasks:index'))
+        beer, cola = Task.objects.order_by('id')
+        self.assertEqual(beer.task_text, " Bier kaufen")
+        self.assertEqual(beer.task_description, "zum Thema in der Sitzung: Getraenke")
+        self.assertEqual(list(beer.assignedTo.all()), [self.user1])
+        self.assertEqual(set(cola.assignedTo.all()), {self.user1, self.user2})
+        self.assertEqual([str(m) for m in response.context['messages']], ["The following users are unknown and were not assigned: gast"])
+        # imported tasks are searchable
+        self.assertEqual(list(search.search(Task.objects.all(), "cola")), [cola])
+
+    def test_queries_independent_of_protocol_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(reverse('tasks:protocolParse'), {'protocol_text': PROTOCOL})
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(reverse('tasks:protocolParse'), {'protocol_text': PROTOCOL * 20})
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Task.objects.count(), 42)
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """A minimal local SMTP server which records the received messages and the number of connections.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, rejected=(), deferred=(), disconnecting=()):
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.port = self.server_address[1]
+        self.rejected = set(rejected)
+        self.deferred = set(deferred)
+        self.disconnecting = set(disconnecting)
+        self.messages = []
+        self.connections = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO', 'MAIL', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.disconnecting:
+                    return
+                if address in self.server.rejected:
+                    self.reply('550 Rejected')
+                elif address in self.server.deferred:
+                    self.reply('450 Try again later')
+                else:
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 Go ahead')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append(message_from_bytes(data))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.smtp = SMTPStandIn(rejected=['nobody@example.org'], deferred=['busy@example.org'], disconnecting=['drop@example.org'])
+        self.settings = override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                          EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.smtp.port,
+                                          EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                                          EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                                          MAIL_QUEUE_MAX_ATTEMPTS=2, MAIL_QUEUE_RETRY_DELAY=60)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.smtp.stop()
+
+    def test_sends_over_one_connection(self):
+        outbox.enqueue("first", "body", ['a@example.org'], 'frudo@example.org')
+        outbox.enqueue("second", "body", ['b@example.org', 'c@example.org'], 'frudo@example.org')
+        self.assertEqual(outbox.send_queued_mail(), (2, 0))
+        self.assertEqual([m['Subject'] for m in self.smtp.messages], ["first", "second"])
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertFalse(OutgoingMail.objects.filter(sent_date=None).exists())
+        # nothing is sent twice
+        self.assertEqual(outbox.send_queued_mail(), (0, 0))
+
+    def test_retries_with_backoff(self):
+        mail = outbox.enqueue("deferred", "body", ['busy@example.org'], 'frudo@example.org')
+        outbox.enqueue("accepted", "body", ['a@example.org'], 'frudo@example.org')
+        with self.assertLogs('tasks.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_queued_mail(), (1, 1))
+        mail.refresh_from_db()
+        self.assertEqual(mail.attempts, 1)
+        self.assertIn("Try again later", mail.last_error)
+        # the connection was kept
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertGreater(mail.next_attempt_date, timezone.now() + timedelta(seconds=50))
+        # not due yet
+        self.assertEqual(outbox.send_queued_mail(), (0, 0))
+        OutgoingMail.objects.filter(pk=mail.pk).update(next_attempt_date=timezone.now())
+        with self.assertLogs('tasks.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_queued_mail(), (0, 1))
+        mail.refresh_from_db()
+        self.assertGreater(mail.next_attempt_date, timezone.now() + timedelta(seconds=110))
+        # MAIL_QUEUE_MAX_ATTEMPTS reached
+        OutgoingMail.objects.filter(pk=mail.pk).update(next_attempt_date=timezone.now())
+        self.assertEqual(outbox.send_queued_mail(), (0, 0))
+
+    def test_permanent_failures_are_not_retried(self):
+        rejected = outbox.enqueue("rejected", "body", ['nobody@example.org'], 'frudo@example.org')
+        invalid = outbox.enqueue("invalid", "body", ['bad\naddress@example.org'], 'frudo@example.org')
+        outbox.enqueue("accepted", "body", ['a@example.org'], 'frudo@example.org')
+        with self.assertLogs('tasks.outbox', 'WARNING') as logs:
+            self.assertEqual(outbox.send_queued_mail(), (1, 2))
+        self.assertEqual(len([line for line in logs.output if "failed permanently" in line]), 2)
+        self.assertEqual([m['Subject'] for m in self.smtp.messages], ["accepted"])
+        self.assertEqual(self.smtp.connections, 1)
+        for mail in (rejected, invalid):
+            mail.refresh_from_db()
+            self.assertEqual(mail.attempts, 2)
+        OutgoingMail.objects.update(next_attempt_date=timezone.now())
+        self.assertEqual(outbox.send_queued_mail(), (0, 0))
+
+    def test_reconnects_once_after_disconnect(self):
+        outbox.enqueue("dropped", "body", ['drop@example.org'], 'frudo@example.org')
+        for subject in ("first", "second", "third"):
+            outbox.enqueue(subject, "body", ['a@example.org'], 'frudo@example.org')
+        with self.assertLogs('tasks.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_queued_mail(), (3, 1))
+        self.assertEqual([m['Subject'] for m in self.smtp.messages], ["first", "second", "third"])
+        self.assertEqual(self.smtp.connections, 2)
+        self.assertEqual(OutgoingMail.objects.get(subject="dropped").attempts, 1)
+
+    def test_concurrent_runs_do_not_send_twice(self):
+        outbox.enqueue("first", "body", ['a@example.org'], 'frudo@example.org')
+        outbox.enqueue("second", "body", ['b@example.org'], 'frudo@example.org')
+        # read by a second run before the first one claims them
+        read = list(OutgoingMail.objects.order_by('id'))
+        self.assertEqual(outbox.send_queued_mail(), (2, 0))
+        self.assertEqual(outbox.claim(read, timezone.now()), [])
+        self.assertEqual(len(self.smtp.messages), 2)
+
+    def test_mails_of_a_dead_run_are_sent_after_the_lease(self):
+        outbox.enqueue("first", "body", ['a@example.org'], 'frudo@example.org')
+        now = timezone.now()
+        self.assertEqual(len(outbox.claim(OutgoingMail.objects.all(), now)), 1)
+        self.assertEqual(outbox.send_queued_mail(), (0, 0))
+        with mock.patch.object(timezone, 'now', return_value=now + timedelta(seconds=settings.MAIL_QUEUE_LEASE)):
+            self.assertEqual(outbox.send_queued_mail(), (1, 0))
+        self.assertEqual(OutgoingMail.objects.get().attempts, 2)
+
+    def test_loop_survives_errors(self):
+        class Stop(BaseException):
+            pass
+        with mock.patch.object(outbox, 'send_queued_mail', side_effect=[OperationalError("database is locked"), (1, 0), Stop]), \
+                mock.patch('time.sleep'), mock.patch('tasks.management.commands.send_queued_mail.close_old_connections'), \
+                self.assertLogs('tasks.management.commands.send_queued_mail') as logs:
+            out = StringIO()
+            with self.assertRaises(Stop):
+                call_command('send_queued_mail', loop=True, stdout=out)
+        self.assertIn("database is locked", logs.output[0])
+        self.assertEqual(out.getvalue(), "Sent 1 mails, 0 failed.\n")
+        # without --loop the error is not hidden
+        with mock.patch.object(outbox, 'send_queued_mail', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                call_command('send_queued_mail', stdout=StringIO())
+
+    def test_unreachable_server(self):
+        self.smtp.stop()
+        outbox.enqueue("first", "body", ['a@example.org'], 'frudo@example.org')
+        with self.assertLogs('tasks.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_queued_mail(), (0, 1))
+        self.assertEqual(OutgoingMail.objects.get().attempts, 1)
+
+    def test_protocol_parse_only_enqueues(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        self.client.post(reverse('tasks:protocolParse'), {'protocol_text': PROTOCOL})
+        self.assertEqual(self.smtp.connections, 0)
+        mail = OutgoingMail.objects.get()
+        self.assertIn("Cola kaufen", mail.body)
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual([m['Subject'] for m in self.smtp.messages], ["SitzungsTODOs"])
+
+    @override_settings(EMAIL_HOST='example.com')
+    def test_nothing_queued_without_mail_server(self):
+        self.assertIsNone(outbox.enqueue("first", "body", ['a@example.org']))
+        self.assertFalse(OutgoingMail.objects.exists())
+
+@override_settings(EMAIL_HOST='mail.example.org', EMAIL_GROUP_RECEIVE='group@example.org')
+class MailsCommandTests(TestCase):
+
+    def setUp(self):
+        time = timezone.now()
+        self.user1 = User.objects.create_user(username='user1')
+        self.user2 = User.objects.create_user(username='user2')
+        User.objects.create_user(username='idle')
+        self.shared = create_task("shared", "", time, time, False, False)
+        self.shared.assignedTo.add(self.user1, self.user2)
+        create_task("own", "", time, time, False, False).assignedTo.add(self.user1)
+        create_task("done", "", time, time, True, False).assignedTo.add(self.user2)
+        self.unassigned = create_task("nobody", "", time, time, False, False)
+
+    def test_digest(self):
+        with self.assertNumQueries(1):
+            call_command('mails')
+        mails = {m.to[0]: m.body for m in mail.outbox}
+        self.assertEqual(set(mails), {'user1@mail.example.org', 'user2@mail.example.org', 'group@example.org'})
+        self.assertIn("shared ( https://frudo.freitagsrunde.org/tasks/%d/ )" % self.shared.id, mails['user2@mail.example.org'])
+        self.assertNotIn("done", mails['user2@mail.example.org'])
+        self.assertIn("own", mails['user1@mail.example.org'])
+        self.assertIn("nobody", mails['group@example.org'])
+
+    def test_unassigned_tasks_come_first(self):
+        rows = list(digest.open_task_assignments())
+        self.assertEqual(rows[0], (None, self.unassigned.id, "nobody"))
+        self.assertEqual([row[0] for row in rows[1:]], ['user1', 'user1', 'user2'])
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('mails', dry_run=True, stdout=out)
+        self.assertEqual(mail.outbox, [])
+        self.assertIn("Would send 3 mails about 4 open task assignments", out.getvalue())
+
+class ProtocolParserTests(TestCase):
+
+    def test_parse(self):
+        items = list(protocol.parse(protocol.text_lines(PROTOCOL.replace("\n", "\r\n"))))
+        topics = [item for item in items if isinstance(item, protocol.Topic)]
+        self.assertEqual([topic.title for topic in topics], ["Begruessung", "Getraenke", "Sonstiges"])
+        todos = [item for item in items if isinstance(item, protocol.Todo)]
+        self.assertEqual(todos, [protocol.Todo(topics[1], "user1, Gast", " Bier kaufen"),
+                                 protocol.Todo(topics[1], "USER2 , user1", " Cola kaufen")])
+        self.assertEqual(protocol.user_names(todos[1]), ["user2", "user1"])
+
+    def test_mail_body(self):
+        body = protocol.mail_body(protocol.todos(protocol.text_lines(PROTOCOL + "#### Mehr\nTODO user1: Pizza\n")))
+        self.assertEqual(body.count("Thema in der Sitzung: "), 2)
+        self.assertIn("Thema in der Sitzung: Mehr\n  TODO:           Pizza\n  Beauftragte(r): user1\n\n", body)
+
+    def test_upload(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        upload = SimpleUploadedFile("protocol.md", (PROTOCOL * 3).encode('utf-8'))
+        self.client.post(reverse('tasks:protocolParse'), {'protocol_file': upload})
+        self.assertEqual(Task.objects.count(), 6)
+
+    def test_upload_windows_1252(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        text = PROTOCOL.replace("Getraenke", "Getränke").replace("Bier kaufen", "Bier kaufen – für 20 €")
+        upload = SimpleUploadedFile("protocol.md", text.encode('cp1252'))
+        response = self.client.post(reverse('tasks:protocolParse'), {'protocol_file': upload})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+        beer = Task.objects.order_by('id').first()
+        self.assertEqual(beer.task_text, " Bier kaufen – für 20 €")
+        self.assertEqual(beer.task_description, "zum Thema in der Sitzung: Getränke")
+
+    def test_import_directory(self):
+        User.objects.create_user(username='user1')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, text in (("2018-05-01.md", PROTOCOL), ("2018-05-08.md", "#### Nichts\n")):
+                with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            out = StringIO()
+            with self.settings(EMAIL_HOST='mail.example.org'):
+                call_command('parse_protocol', directory, mail=True, stdout=out, stderr=StringIO())
+        self.assertIn("2 tasks imported.", out.getvalue())
+        self.assertIn("unknown users: gast, user2", out.getvalue())
+        self.assertEqual(OutgoingMail.objects.count(), 1)
+
+    @mock.patch.object(protocol, 'BATCH_SIZE', 3)
+    def test_import_in_batches(self):
+        User.objects.create_user(username='user1')
+        tasks, unknown_users = protocol.import_todos(protocol.todos(protocol.text_lines(PROTOCOL * 4)))
+        self.assertEqual(len(tasks), 8)
+        self.assertEqual(len({task.pk for task in tasks}), 8)
+        self.assertEqual([task.task_text for task in tasks], [" Bier kaufen", " Cola kaufen"] * 4)
+        self.assertEqual(Task.assignedTo.through.objects.count(), 8)
+
+class HTTPStandIn(socketserver.ThreadingMixIn, HTTPServer):
+    """A minimal local HTTP server serving one protocol with an ETag, which records the response codes.
+    """
+    daemon_threads = True
+
+    def __init__(self, body):
+        super().__init__(('127.0.0.1', 0), HTTPStandInHandler)
+        self.url = 'http://127.0.0.1:%d/p/sitzung/export/txt' % self.server_address[1]
+        self.body = body
+        self.encoding = 'utf-8'
+        self.content_type = 'text/plain; charset=utf-8'
+        self.redirect = None
+        self.responses = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class HTTPStandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.server.redirect:
+            self.server.responses.append(302)
+            self.send_response(302)
+            self.send_header('Location', self.server.redirect)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.body.encode(self.server.encoding)
+        etag = '"%d"' % hash(body)
+        if self.headers.get('If-None-Match') == etag:
+            self.server.responses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.responses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', self.server.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class ProtocolURLTests(TestCase):
+
+    def setUp(self):
+        self.http = HTTPStandIn(PROTOCOL)
+        self.cache = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PROTOCOL_CACHE_DIR=self.cache.name, PROTOCOL_FETCH_MAX_SIZE=1024, PROTOCOL_URL_HOSTS=['127.0.0.1'])
+        self.settings.enable()
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.cache.cleanup()
+        self.http.stop()
+
+    def post(self, url=None):
+        return self.client.post(reverse('tasks:protocolParse'), {'protocol_url': url or self.http.url}, follow=True)
+
+    def test_unchanged_protocol_is_not_imported_again(self):
+        self.post()
+        self.assertEqual(Task.objects.count(), 2)
+        response = self.post()
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(self.http.responses, [200, 304])
+        self.assertIn("has not changed", [str(m) for m in response.context['messages']][0])
+
+        self.http.body = PROTOCOL + "TODO user1: Pizza bestellen\n"
+        self.post()
+        self.assertEqual(Task.objects.count(), 5)
+        self.assertEqual(self.http.responses, [200, 304, 200])
+
+    def test_size_cap(self):
+        self.http.body = PROTOCOL * 100
+        response = self.post()
+        self.assertIn("larger than 1024 bytes", response.context['form'].errors['protocol_url'][0])
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(os.listdir(self.cache.name), [])
+
+    def test_unreachable(self):
+        self.http.stop()
+        response = self.post()
+        self.assertIn("could not be fetched", response.context['form'].errors['protocol_url'][0])
+
+    def test_only_allowed_hosts(self):
+        for url in ('http://localhost:%d/p/sitzung/export/txt' % self.http.server_address[1], 'file:///etc/passwd',
+                    'ftp://127.0.0.1/protocol.txt', 'http:///protocol.txt', 'http://[::1/'):
+            response = self.post(url)
+            self.assertEqual(len(response.context['form'].errors['protocol_url']), 1, url)
+        self.assertEqual(self.http.responses, [])
+        self.assertFalse(Task.objects.exists())
+
+    def test_redirect_is_not_followed(self):
+        self.http.redirect = 'http://localhost/internal'
+        response = self.post()
+        self.assertIn("redirects to http://localhost/internal", response.context['form'].errors['protocol_url'][0])
+        self.assertEqual(self.http.responses, [302])
+
+    def test_no_charset(self):
+        # requests assumes ISO-8859-1 for text/* without a charset, an Etherpad export is UTF-8
+        self.http.body = PROTOCOL.replace("Getraenke", "Getränke")
+        self.http.content_type = 'text/plain'
+        self.post()
+        self.assertEqual(Task.objects.order_by('id').first().task_description, "zum Thema in der Sitzung: Getränke")
+
+        Task.objects.all().delete()
+        self.http.body = PROTOCOL.replace("Bier kaufen", "Bier kaufen für 20 €")
+        self.http.encoding = 'cp1252'
+        self.post()
+        self.assertEqual(Task.objects.order_by('id').first().task_text, " Bier kaufen für 20 €")
+
+    def test_wrong_charset(self):
+        self.http.body = PROTOCOL.replace("Bier kaufen", "Bier kaufen für 20 €")
+        self.http.encoding = 'cp1252'
+        response = self.post()
+        self.assertIn("could not be decoded", response.context['form'].errors['protocol_url'][0])
+        self.assertFalse(Task.objects.exists())
+        self.http.encoding = 'utf-8'
+        self.post()
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_failed_import_is_fetched_again(self):
+        with mock.patch.object(protocol, 'import_todos', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post()
+        self.post()
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(self.http.responses, [200, 200])
+
+class TaskRowCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        self.label = create_label("label", "a label", "#000000")
+        self.task = create_task("test", "testi", time, time, False, False)
+        self.task.labels.add(self.label)
+        fragments.reset_stats()
+
+    def get(self):
+        # the CSRF token of the batch action form is masked differently on every page
+        return re.sub(r"name='csrfmiddlewaretoken' value='\w+'", '', self.client.get(reverse('tasks:index')).content.decode())
+
+    def test_hits_skip_rendering_queries(self):
+        rendered = self.get()
+        # user, version, tasks
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get(), rendered)
+        self.assertEqual(fragments.stats(), {'hits': 1, 'misses': 1})
+
+    def test_metrics(self):
+        hits = metrics._registry.get_sample_value('frudo_task_row_cache_requests_total', {'result': 'hit'}) or 0
+        self.get()
+        self.get()
+        self.assertEqual(metrics._registry.get_sample_value('frudo_task_row_cache_requests_total', {'result': 'hit'}), hits + 1)
+
+    def test_command_needs_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, "local to every process"):
+            call_command('task_row_cache', stdout=StringIO())
+        with tempfile.TemporaryDirectory() as location:
+            shared = dict(settings.CACHES, task_rows={'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location})
+            with override_settings(CACHES=shared):
+                self.get()
+                self.get()
+                out = StringIO()
+                call_command('task_row_cache', '--clear', stdout=out)
+                self.assertIn("hits: 1, misses: 1", out.getvalue())
+                self.assertEqual(fragments.cache().get_many([fragments.HITS_KEY]), {})
+
+    def test_invalidation(self):
+        self.assertNotIn("renamed", self.get())
+        self.label.label_text = "renamed"
+        self.label.save()
+        self.assertIn("renamed", self.get())
+
+        other = User.objects.create_user(username='assignee')
+        self.task.assignedTo.add(other)
+        self.assertIn("assignee", self.get())
+        other.username = "newname"
+        other.save()
+        self.assertIn("newname", self.get())
+        self.task.assignedTo.remove(other)
+        self.assertNotIn("newname", self.get())
+
+        self.task.task_text = "changed title"
+        self.task.save()
+        self.assertIn("changed title", self.get())
+
+        self.label.task_set.clear()
+        self.assertNotIn("renamed", self.get())
+        self.assertEqual(fragments.stats()['hits'], 0)
+
+    def test_change_while_rendering(self):
+        original = fragments.versions
+
+        def rename_first(task_ids):
+            # the task is changed after the page was selected, before the version tokens are read
+            task = Task.objects.get(pk=self.task.pk)
+            task.task_text = "renamed meanwhile"
+            task.save()
+            return original(task_ids)
+
+        with mock.patch.object(fragments, 'versions', rename_first):
+            self.get()
+        self.assertIn("renamed meanwhile", self.get())
+
+    def test_logins_do_not_invalidate(self):
+        self.task.assignedTo.add(self.user)
+        self.get()
+        self.client.login(username='user1', password='12345')
+        self.get()
+        self.assertEqual(fragments.stats(), {'hits': 1, 'misses': 1})
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        self.task = create_task("test", "testi", time, time, False, False)
+
+    def assertNotModified(self, url, **headers):
+        # the first visit of a page with a form sets the CSRF cookie, which is part of the ETag
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # user, version
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **headers)
+        self.assertEqual(response.status_code, 304)
+        return response['ETag']
+
+    def assertModified(self, url, etag):
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_changes(self):
+        url = reverse('tasks:index')
+        etag = self.assertNotModified(url)
+        self.task.task_text = "changed"
+        self.task.save()
+        self.assertModified(url, etag)
+
+        etag = self.assertNotModified(url)
+        self.task.labels.add(create_label("label", "", "#000000"))
+        self.assertModified(url, etag)
+
+        etag = self.assertNotModified(url)
+        Comment.objects.create(comment_text="comment", comment_user=self.user, comment_task=self.task, comment_date=timezone.now())
+        self.assertModified(url, etag)
+
+        etag = self.assertNotModified(url)
+        self.task.delete()
+        self.assertModified(url, etag)
+
+    def test_finish_changes_both_lists(self):
+        etags = [self.assertNotModified(reverse(url)) for url in ('tasks:index', 'tasks:closedTasks')]
+        self.client.get(reverse('tasks:finishTask', args=(self.task.id,)))
+        self.assertModified(reverse('tasks:index'), etags[0])
+        self.assertModified(reverse('tasks:closedTasks'), etags[1])
+
+    def test_detail(self):
+        url = reverse('tasks:detail', args=(self.task.id,))
+        etag = self.assertNotModified(url)
+        self.client.post(url, {'comment_text': "hello"})
+        self.assertModified(url, etag)
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_other_user_and_query_string(self):
+        url = reverse('tasks:index')
+        etag = self.assertNotModified(url)
+        self.assertModified(url + '?filter=test', etag)
+        User.objects.create_user(username='user2', password='12345')
+        self.client.login(username='user2', password='12345')
+        self.assertModified(url, etag)
+
+class TaskAPITests(TestCase):
+
+    client_class = APIClient
+
+    # user, tasks, assignees, labels
+    LIST_QUERIES = 4
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.other = User.objects.create_user(username='user2', password='12345')
+        self.label = create_label("label", "a label", "#000000")
+        self.client.login(username='user1', password='12345')
+
+    def create_tasks(self, count):
+        time = timezone.now()
+        for i in range(count):
+            task = create_task("task %d" % i, "description", time, time, False, False)
+            task.assignedTo.add(self.user)
+            task.labels.add(self.label)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/tasks/').status_code, 403)
+
+    def test_list_query_count_is_constant(self):
+        self.create_tasks(3)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            self.client.get('/api/tasks/')
+        self.create_tasks(20)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get('/api/tasks/')
+        task = response.json()['results'][0]
+        self.assertEqual(task['assignedTo'], ['user1'])
+        self.assertEqual(task['labels'], [self.label.pk])
+
+    def test_sparse_fields_skip_prefetch(self):
+        self.create_tasks(3)
+        with self.assertNumQueries(self.LIST_QUERIES - 2):
+            response = self.client.get('/api/tasks/', {'fields': 'id,task_text'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'task_text'})
+
+    def test_cursor_pagination(self):
+        self.create_tasks(5)
+        seen = []
+        url = '/api/tasks/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [task['task_text'] for task in page['results']]
+            url = page['next']
+        self.assertEqual(seen, ["task %d" % i for i in range(5)])
+
+    def test_bulk_create(self):
+        data = [{'task_text': "bulk %d" % i, 'task_description': "description", 'finished_date': '2030-01-01',
+                 'important': False, 'assignedTo': ['user1', 'user2'], 'labels': [self.label.pk]} for i in range(30)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/tasks/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(len(queries), 30)
+        self.assertEqual(Task.objects.count(), 30)
+        self.assertEqual(Task.assignedTo.through.objects.count(), 60)
+        task = Task.objects.get(task_text="bulk 7")
+        self.assertEqual(response.json()[7]['id'], task.pk)
+        self.assertEqual(response.json()[7]['assignedTo'], ['user1', 'user2'])
+        self.assertEqual(list(search.search(Task.objects.all(), "bulk")), list(Task.objects.order_by('id')))
+
+    def test_bulk_create_rejects_unknown_users(self):
+        data = [{'task_text': "bulk", 'task_description': "description", 'finished_date': '2030-01-01', 'assignedTo': ['nobody']}]
+        response = self.client.post('/api/tasks/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("nobody", str(response.json()))
+        self.assertFalse(Task.objects.exists())
+
+    def test_bulk_update(self):
+        self.create_tasks(50)
+        tasks = list(Task.objects.order_by('id'))
+        old_versions = fragments.versions([task.pk for task in tasks])
+        data = [{'id': task.pk, 'is_finished': True, 'task_text': "updated %d" % task.pk, 'assignedTo': ['user2']} for task in tasks]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/api/tasks/bulk/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 25)
+        self.assertFalse(Task.objects.filter(is_finished=False).exists())
+        self.assertEqual(Task.objects.get(pk=tasks[3].pk).task_text, "updated %d" % tasks[3].pk)
+        self.assertEqual(set(Task.assignedTo.through.objects.values_list('user_id', flat=True)), {self.other.pk})
+        # the labels were not sent and are kept
+        self.assertEqual(Task.labels.through.objects.count(), 50)
+        self.assertTrue(all(Task.objects.get(pk=task.pk).updated_at > task.updated_at for task in tasks))
+        new_versions = fragments.versions([task.pk for task in tasks])
+        self.assertFalse(any(old_versions[pk] == new_versions[pk] for pk in old_versions))
+        self.assertEqual(search.search(Task.objects.all(), "updated").count(), 50)
+
+    def test_bulk_update_needs_known_ids(self):
+        self.create_tasks(1)
+        response = self.client.patch('/api/tasks/bulk/', [{'id': 12345, 'is_finished': True}], format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch('/api/tasks/bulk/', [{'is_finished': True}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_and_update_one_task(self):
+        response = self.client.post('/api/tasks/', {'task_text': "single", 'task_description': "description",
+                                                    'finished_date': '2030-01-01', 'assignedTo': ['user2']},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        task = Task.objects.get()
+        self.assertEqual(list(task.assignedTo.all()), [self.other])
+        response = self.client.patch('/api/tasks/%d/' % task.pk, {'labels': [self.label.pk]}, format='json')
+        self.assertEqual(response.json()['labels'], [self.label.pk])
+        self.assertEqual(response.json()['assignedTo'], ['user2'])
+
+    def test_comments(self):
+        self.create_tasks(2)
+        task = Task.objects.first()
+        response = self.client.post('/api/comments/', {'comment_task': task.pk, 'comment_text': "a comment"}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['comment_user'], 'user1')
+        self.assertEqual(len(self.client.get('/api/comments/', {'task': task.pk}).json()['results']), 1)
+        self.assertEqual(len(self.client.get('/api/comments/', {'task': task.pk + 1}).json()['results']), 0)
+
+class BatchActionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='12345')
+        self.other = User.objects.create_user(username='user2', password='12345')
+        self.label = create_label("label", "a label", "#000000")
+        self.client.login(username='user1', password='12345')
+        time = timezone.now()
+        self.tasks = [create_task("task %d" % i, "testi", time, time, False, False) for i in range(10)]
+        for task in self.tasks:
+            task.assignedTo.add(self.user)
+
+    def post(self, data):
+        data.setdefault('tasks', [task.pk for task in self.tasks[:5]])
+        data.setdefault('next', reverse('tasks:index'))
+        return self.client.post(reverse('tasks:batch'), data)
+
+    def test_close_is_one_update(self):
+        self.client.get(reverse('tasks:index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({'action': 'close'})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(Task.objects.filter(is_finished=True).count(), 5)
+        # the cached rows and the conditional GET see the change
+        response = self.client.get(reverse('tasks:index'))
+        self.assertContains(response, "5 tasks were closed.")
+        self.assertEqual(len(response.context['tasks_list']), 5)
+        self.assertEqual(len(self.client.get(reverse('tasks:closedTasks')).context['tasks_list']), 5)
+
+    def test_submit_checked_rows(self):
+        # once rendered and once from the row cache
+        for _ in range(2):
+            response = self.client.get(reverse('tasks:index'))
+            checkboxes = re.findall(r'<input type="checkbox"[^>]* name="tasks" value="(\d+)" form="batch-form"', response.content.decode())
+            self.assertEqual(sorted(map(int, checkboxes)), sorted(task.pk for task in self.tasks))
+        form = re.search(r'<form id="batch-form"[^>]* action="([^"]+)"', response.content.decode())
+        next_url = re.search(r'<input type="hidden" name="next" value="([^"]+)"', response.content.decode()).group(1)
+        response = self.client.post(form.group(1), {'action': 'close', 'next': next_url, 'tasks': checkboxes[:2]})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+        self.assertEqual(set(Task.objects.filter(is_finished=True).values_list('pk', flat=True)), set(map(int, checkboxes[:2])))
+
+    def test_reopen_only_changes_closed_tasks(self):
+        Task.objects.filter(pk=self.tasks[0].pk).update(is_finished=True)
+        self.post({'action': 'reopen', 'next': reverse('tasks:closedTasks')})
+        self.assertFalse(Task.objects.filter(is_finished=True).exists())
+        response = self.client.get(reverse('tasks:closedTasks'))
+        self.assertContains(response, "1 tasks were reopened.")
+
+    def test_relabel_asks_for_labels(self):
+        response = self.post({'action': 'relabel'})
+        self.assertTemplateUsed(response, 'tasks/batch.html')
+        self.assertFalse(Task.labels.through.objects.exists())
+        self.post({'action': 'relabel', 'labels': [self.label.pk], 'confirm': '1'})
+        self.assertEqual(set(Task.labels.through.objects.values_list('task_id', flat=True)), {task.pk for task in self.tasks[:5]})
+
+    def test_reassign_replaces_assignees(self):
+        self.post({'action': 'reassign', 'assignedTo': [self.other.pk], 'confirm': '1'})
+        self.assertEqual(list(self.tasks[0].assignedTo.all()), [self.other])
+        self.assertEqual(list(self.tasks[9].assignedTo.all()), [self.user])
+
+    def test_nothing_selected(self):
+        response = self.post({'action': 'close', 'tasks': []})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('tasks:index')), "Select at least one task")
+
+    def test_unsafe_next(self):
+        response = self.post({'action': 'close', 'next': 'https://example.org/'})
+        self.assertRedirects(response, reverse('tasks:index'), fetch_redirect_response=False)
+
+    def test_finish_task_writes_only_the_state(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('tasks:finishTask', args=[self.tasks[0].pk]))
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('task_text', updates[0])
+        self.assertTrue(Task.objects.get(pk=self.tasks[0].pk).is_finished)
+        self.client.get(reverse('tasks:reopen', args=[self.tasks[0].pk]))
+        self.assertFalse(Task.objects.get(pk=self.tasks[0].pk).is_finished)
+        self.assertEqual(self.client.get(reverse('tasks:finishTask', args=[12345])).status_code, 404)
+
+class DatabaseSettingsTests(TestCase):
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -20000)
+
+    def test_wal_on_file_database(self):
+        # the test database lives in memory, which has no journal
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(connections['default'].settings_dict, NAME=os.path.join(directory, 'test.sqlite3'))
+            wrapper = type(connections['default'])(settings_dict, alias='wal-test')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+            finally:
+                wrapper.close()
+
+class ReplicaRouterTests(TestCase):
+
+    REPLICATED = (User, Session, Task, Comment)
+
+    def setUp(self):
+        # the replica is a second SQLite file, which is updated by replicate()
+        self.directory = tempfile.TemporaryDirectory()
+        connections.databases['test-replica'] = dict(connections['default'].settings_dict, NAME=os.path.join(self.directory.name, 'replica.sqlite3'))
+        call_command('migrate', database='test-replica', verbosity=0)
+        self.settings = override_settings(DATABASE_REPLICA_ALIASES=['test-replica'])
+        self.settings.enable()
+        self.user = User.objects.create_user(username='user1', password='12345')
+        time = timezone.now()
+        self.task = create_task("test", "testi", time, time, False, False)
+        self.client.login(username='user1', password='12345')
+        self.replicate()
+        routers.reset()
+
+    def tearDown(self):
+        self.settings.disable()
+        connections['test-replica'].close()
+        delattr(connections._connections, 'test-replica')
+        del connections.databases['test-replica']
+        self.directory.cleanup()
+        routers.reset()
+
+    def replicate(self):
+        for model in reversed(self.REPLICATED):
+            model.objects.using('test-replica').all().delete()
+        for model in self.REPLICATED:
+            model.objects.using('test-replica').bulk_create(model.objects.using('default').all())
+
+    def queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['test-replica']) as replica:
+            response = getattr(self.client, method)(url, data)
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_replica(self):
+        for url in (reverse('tasks:index'), reverse('tasks:closedTasks'), reverse('tasks:detail', args=(self.task.id,))):
+            response, primary, replica = self.queries('get', url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(primary, 0)
+            self.assertGreater(replica, 0)
+            self.assertNotIn(middleware.PIN_COOKIE, response.cookies)
+
+    def test_read_after_write(self):
+        url = reverse('tasks:detail', args=(self.task.id,))
+        response, primary, replica = self.queries('post', url, {'comment_text': "replicated comment"})
+        self.assertEqual(replica, 0)
+        self.assertIn(middleware.PIN_COOKIE, response.cookies)
+        # the redirected client sees its comment, although the replica does not have it yet
+        response, primary, replica = self.queries('get', url)
+        self.assertContains(response, "replicated comment")
+        self.assertEqual(replica, 0)
+        # once the pin cookie has expired the replica is used again
+        del self.client.cookies[middleware.PIN_COOKIE]
+        response, primary, replica = self.queries('get', url)
+        self.assertEqual(primary, 0)
+        self.assertNotContains(response, "replicated comment")
+        self.replicate()
+        self.assertContains(self.client.get(url), "replicated comment")
+
+    def test_mirror_of_the_default_database_is_not_used(self):
+        connections['test-replica'].settings_dict['NAME'] = connections['default'].settings_dict['NAME']
+        self.assertEqual(routers.replicas(), [])
+        self.assertEqual(Task.objects.all().db, 'default')
+
+    def test_outbox_reads_primary(self):
+        with CaptureQueriesContext(connections['test-replica']) as replica:
+            outbox.send_queued_mail()
+        self.assertEqual(len(replica), 0)
+
+    def test_no_migrations_on_replicas(self):
+        router = routers.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('test-replica', 'tasks'))
+        self.assertTrue(router.allow_migrate('default', 'tasks'))
+
+
+class LDAPStandIn:
+    """A stand-in for the python-ldap module with a directory of one user."""
+
+    USER_DN = 'uid=user1,ou=people,dc=example,dc=org'
+
+    def __init__(self):
+        self.connections = 0
+        self.binds = 0
+        self.searches = 0
+        self.open = []
+        self.password = 'secret'
+        self.attrs = {'givenName': [b'Ada'], 'sn': [b'Lovelace'], 'mail': [b'ada@example.org']}
+
+    def initialize(self, uri, bytes_mode=False):
+        self.connections += 1
+        connection = LDAPStandInConnection(self)
+        self.open.append(connection)
+        return connection
+
+    def drop_connections(self):
+        """Closes the open connections the way an idle timeout of the server does."""
+        for connection in self.open:
+            connection.alive = False
+        self.open = []
+
+    def __getattr__(self, name):
+        return getattr(ldap, name)
+
+class LDAPStandInConnection:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.alive = True
+
+    def check_alive(self):
+        if not self.alive:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+
+    def set_option(self, option, value):
+        pass
+
+    def simple_bind_s(self, who, cred):
+        self.check_alive()
+        self.directory.binds += 1
+        if who == self.directory.USER_DN and cred != self.directory.password:
+            raise ldap.INVALID_CREDENTIALS()
+
+    def search_s(self, base, scope, filterstr, attrlist=None):
+        self.check_alive()
+        self.directory.searches += 1
+        if base == self.directory.USER_DN or '(uid=user1)' in filterstr:
+            return [(self.directory.USER_DN, dict(self.directory.attrs))]
+        return []
+
+    def unbind_s(self):
+        pass
+
+@skipIf(ldap is None, "python-ldap is not installed")
+class LDAPCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = LDAPStandIn()
+        self.settings = override_settings(AUTHENTICATION_BACKENDS=['tasks.ldapauth.CachedLDAPBackend'],
+                                          AUTH_LDAP_SERVER_URI='ldap://stand-in',
+                                          AUTH_LDAP_BIND_DN='cn=frudo,dc=example,dc=org', AUTH_LDAP_BIND_PASSWORD='frudo',
+                                          AUTH_LDAP_USER_SEARCH=LDAPSearch('ou=people,dc=example,dc=org', ldap.SCOPE_SUBTREE, '(uid=%(user)s)'),
+                                          LDAP_AUTH_CACHE_TIMEOUT=300)
+        self.settings.enable()
+        self.patch = mock.patch('django_auth_ldap.backend._LDAPConfig.get_ldap', return_value=self.directory)
+        self.patch.start()
+        ldapauth.cache().clear()
+        ldapauth.close_connections()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.settings.disable()
+        ldapauth.close_connections()
+
+    def authenticate(self, password='secret'):
+        return authenticate(username='user1', password=password)
+
+    def forget_logins(self):
+        # keeps the counters
+        stats = ldapauth.stats()
+        ldapauth.cache().clear()
+        ldapauth.cache().set_many({ldapauth.HITS_KEY: stats['hits'], ldapauth.MISSES_KEY: stats['misses'],
+                                   ldapauth.REQUESTS_KEY: stats['directory_requests'], ldapauth.LATENCY_KEY: stats['directory_ms']}, timeout=None)
+
+    def test_login_is_cached(self):
+        user = self.authenticate()
+        self.assertEqual((user.username, user.first_name, user.email), ('user1', 'Ada', 'ada@example.org'))
+        binds, searches = self.directory.binds, self.directory.searches
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(), user)
+        self.assertEqual((self.directory.binds, self.directory.searches), (binds, searches))
+        stats = ldapauth.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['directory_requests']), (1, 1, 1))
+
+    def test_failed_login_is_not_cached(self):
+        self.assertIsNone(self.authenticate('wrong'))
+        binds = self.directory.binds
+        self.assertIsNone(self.authenticate('wrong'))
+        self.assertGreater(self.directory.binds, binds)
+        self.assertIsNotNone(self.authenticate())
+
+    def test_connection_is_reused(self):
+        self.authenticate()
+        self.forget_logins()
+        self.authenticate()
+        self.assertEqual(ldapauth.stats()['directory_requests'], 2)
+        self.assertEqual(self.directory.connections, 1)
+
+    def test_dropped_connection_is_replaced(self):
+        self.authenticate()
+        self.forget_logins()
+        self.directory.drop_connections()
+        user = self.authenticate()
+        self.assertIsNotNone(user)
+        self.assertEqual(self.directory.connections, 2)
+        # the new connection is kept
+        self.forget_logins()
+        self.authenticate()
+        self.assertEqual(self.directory.connections, 2)
+
+    def test_unchanged_attributes_are_not_written(self):
+        self.authenticate()
+        self.forget_logins()
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticate()
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+
+        self.directory.attrs['sn'] = [b'King']
+        self.forget_logins()
+        with CaptureQueriesContext(connection) as queries:
+            user = self.authenticate()
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('first_name', updates[0])
+        self.assertEqual(User.objects.get(pk=user.pk).last_name, 'King')
+
+    def test_metrics(self):
+        hits = metrics._registry.get_sample_value('frudo_ldap_auth_cache_requests_total', {'result': 'hit'}) or 0
+        requests = metrics._registry.get_sample_value('frudo_ldap_directory_duration_seconds_count') or 0
+        self.authenticate()
+        self.authenticate()
+        self.assertEqual(metrics._registry.get_sample_value('frudo_ldap_auth_cache_requests_total', {'result': 'hit'}), hits + 1)
+        self.assertEqual(metrics._registry.get_sample_value('frudo_ldap_directory_duration_seconds_count'), requests + 1)
+
+    def test_stats_command_needs_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, "local to every process"):
+            call_command('ldap_auth_stats', stdout=StringIO())
+
+    def test_cache_can_be_disabled(self):
+        with override_settings(LDAP_AUTH_CACHE_TIMEOUT=0):
+            self.authenticate()
+            self.authenticate()
+        stats = ldapauth.stats()
+        self.assertEqual((stats['hits'], stats['directory_requests']), (0, 2))
+
+class SessionTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+
+    def test_one_auth_query_per_request(self):
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('tasks:index'))
+            auth = [q['sql'] for q in queries.captured_queries if 'django_session' in q['sql'] or 'auth_user' in q['sql']]
+            self.assertEqual(len(auth), 1)
+            self.assertIn('auth_user', auth[0])
+
+    def test_cleanup_command(self):
+        past = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            Session.objects.create(session_key='expired%d' % i, session_data='', expire_date=past)
+        out = StringIO()
+        call_command('cleanup_sessions', '--batch-size', '2', stdout=out)
+        self.assertIn("5 expired sessions removed", out.getvalue())
+        # the session of the logged in user is kept
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(self.client.get(reverse('tasks:index')).status_code, 200)
+
+class StaticFilesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # compressing the files takes a while, so they are collected once for all tests
+        cls.root = tempfile.TemporaryDirectory()
+        cls.static_root = override_settings(STATIC_ROOT=cls.root.name, STATICFILES_STORAGE='tasks.storage.StaticFilesStorage')
+        cls.static_root.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.static_root.disable()
+        cls.root.cleanup()
+
+    def test_pages_link_hashed_names(self):
+        response = self.client.get(reverse('login'))
+        self.assertRegex(response.content.decode(), r'/static/tasks/tasks\.[0-9a-f]{12}\.css')
+        self.assertRegex(response.content.decode(), r'/static/registration/login\.[0-9a-f]{12}\.css')
+
+    def test_hashed_files_are_immutable_and_compressed(self):
+        url = re.search(r'/static/tasks/tasks\.[0-9a-f]{12}\.css', self.client.get(reverse('login')).content.decode()).group()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(os.path.exists(os.path.join(self.root.name, url[len('/static/'):] + '.gz')))
+
+    def test_plain_names_are_revalidated(self):
+        response = self.client.get('/static/tasks/tasks.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        call_command('generate_data', '--users', '5', '--labels', '3', '--tasks', '100', '--comments', '300',
+                     '--closed-ratio', '0.3', stdout=StringIO(), stderr=StringIO())
+
+    def test_generated_data(self):
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Label.objects.count(), 3)
+        self.assertEqual(Task.objects.count(), 100)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(Task.objects.filter(is_finished=True).exists())
+        # the comments are indexed
+        word = Comment.objects.first().comment_text.split()[0]
+        self.assertTrue(search.search(Task.objects.all(), word).exists())
+
+    @override_settings(TASKS_PAGE_SIZE=5)
+    def test_every_route_is_benchmarked(self):
+        out = StringIO()
+        call_command('benchmark', '--repeat', '2', '--warmup', '0', '--protocol-todos', '5', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset']['tasks'], 100)
+        self.assertEqual({result['route'] for result in report['results']} - {None}, set(benchmark.routes()))
+        for result in report['results']:
+            self.assertTrue(all(status in ('200', '201', '302') for status in result['status']), result)
+            self.assertLessEqual(result['ms']['p50'], result['ms']['max'])
+        # the writes of the benchmark are rolled back
+        self.assertEqual(Task.objects.count(), 100)
+        self.assertEqual(Label.objects.count(), 3)
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        self.task = create_task("Metrics", "Description", timezone.now().date(), timezone.now(), False, False)
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('tasks.metrics', 'INFO') as logs:
+            response = self.client.get(reverse('tasks:index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        metrics = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertEqual(metrics['view'], 'tasks:index')
+        self.assertEqual(metrics['status'], 200)
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreater(metrics['template_ms'], 0)
+        self.assertIn('SELECT', metrics['slowest_query'])
+        self.assertNotIn('duplicates', metrics)
+
+    @override_settings(REQUEST_METRICS_MAX_QUERIES=1)
+    def test_duplicate_queries_of_expensive_requests(self):
+        with self.assertLogs('tasks.metrics', 'INFO') as logs:
+            self.client.get(reverse('tasks:edit', args=(self.task.pk,)))
+        metrics = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertEqual(metrics['view'], 'tasks:edit')
+        # the edit view loads the task more than once
+        self.assertTrue(any('"tasks_task"' in query['sql'] and query['identical'] for query in metrics['duplicates']))
+
+    @override_settings(REQUEST_METRICS=False)
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('tasks:index')))
+
+class ProfilerTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PROFILE_DIR=self.directory.name)
+        self.settings.enable()
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='12345')
+        User.objects.create_user(username='user1', password='12345')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_superuser_profiles_request(self):
+        self.client.login(username='admin', password='12345')
+        response = self.client.get(reverse('tasks:index'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        base = os.path.join(self.directory.name, response['X-Profile'])
+        self.assertIn('tasks_index', base)
+        self.assertTrue(os.path.exists(base + '.pstats'))
+        with open(base + '.collapsed.txt') as f:
+            stacks = f.read().splitlines()
+        self.assertTrue(all(re.match(r'^\S.* \d+$', line) for line in stacks))
+        # the template is rendered inside the profile
+        self.assertTrue(any('render (' in line for line in stacks))
+
+    def test_other_users_are_not_profiled(self):
+        self.client.login(username='user1', password='12345')
+        response = self.client.get(reverse('tasks:index') + '?profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_rotation(self):
+        for number in range(3):
+            path = os.path.join(self.directory.name, 'old%d.pstats' % number)
+            with open(path, 'w') as f:
+                f.write('x' * 100)
+            os.utime(path, (number, number))
+        with override_settings(PROFILE_DIR_MAX_BYTES=250):
+            profiling.rotate()
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['old1.pstats', 'old2.pstats'])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('profile', 'protocol', '--todos', '20', '--import', stdout=out)
+        self.assertIn("20 TODOs parsed.", out.getvalue())
+        self.assertIn("import_todos", out.getvalue())
+        # the import is rolled back
+        self.assertFalse(Task.objects.exists())
+        call_command('profile', 'mails', stdout=StringIO())
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if name.endswith('.collapsed.txt')]), 2)
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        caches[settings.METRICS_AGGREGATE_CACHE].delete(metrics.AGGREGATES_KEY)
+        User.objects.create_user(username='user1', password='12345')
+        self.client.login(username='user1', password='12345')
+        create_task("Open", "Description", timezone.now().date(), timezone.now(), False, False)
+
+    def sample(self, name, **labels):
+        return metrics._registry.get_sample_value(name, labels) or 0
+
+    def test_metrics(self):
+        before = self.sample('frudo_request_duration_seconds_count', view='tasks:index', method='GET', status='200')
+        self.client.get(reverse('tasks:index'))
+        self.assertEqual(self.sample('frudo_request_duration_seconds_count', view='tasks:index', method='GET', status='200'), before + 1)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('frudo_request_duration_seconds_bucket{le="0.005",method="GET",status="200",view="tasks:index"}', content)
+        self.assertIn('frudo_request_queries_count{view="tasks:index"}', content)
+        self.assertIn('frudo_tasks{state="open"} 1.0', content)
+        self.assertIn('frudo_tasks{state="closed"} 0.0', content)
+        self.assertIn('frudo_outbox_queued_mails 0.0', content)
+
+    def test_gauges_are_cached(self):
+        self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        create_task("Closed", "Description", timezone.now().date(), timezone.now(), True, False)
+        with self.assertNumQueries(0):
+            content = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('frudo_tasks{state="closed"} 0.0', content)
+
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_only_with_debug(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(EMAIL_HOST='mail.example.org')
+    def test_business_metrics(self):
+        sent = self.sample('frudo_mails_sent_total', source='reminder')
+        imports = self.sample('frudo_protocol_import_todos_count')
+        unknown = self.sample('frudo_protocol_unknown_users_total')
+        call_command('mails')
+        protocol.import_todos(protocol.todos(protocol.text_lines("TODO nobody: eins\nTODO user1: zwei\n")))
+        self.assertEqual(self.sample('frudo_mails_sent_total', source='reminder'), sent + 1)
+        self.assertEqual(self.sample('frudo_protocol_import_todos_count'), imports + 1)
+        self.assertEqual(self.sample('frudo_protocol_unknown_users_total'), unknown + 1)
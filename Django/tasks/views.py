@@ -3,52 +3,61 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic
 from django.contrib.auth.models import User
 from django.urls import reverse_lazy, reverse
-from django.core.mail import EmailMessage
 from django.utils import timezone
-from django.http import HttpResponseRedirect
-from datetime import datetime, timedelta
+from django.utils.http import is_safe_url
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.db.models import prefetch_related_objects
+from django.contrib import messages
 from django.conf import settings
 import logging
-import re
 
-from .models import Task, Comment, Label
-from .forms import CreateTaskForm, CreateCommentForm, CreateLabelForm, ProtocolParseForm
+from .models import Task, Comment, Label, task_update_fields
+from .serializers import CommentSerializer
+from .forms import BatchActionForm, CreateTaskForm, CreateCommentForm, CreateLabelForm, ProtocolParseForm
+from .pagination import KeysetPaginationMixin, comment_page
+from .fragments import CachedTaskRowsMixin
+from .conditional import TaskConditionalMixin, TaskListConditionalMixin
+from . import bulk, fetch, outbox, protocol, search
 # Create your views here.
 
-class IndexView(LoginRequiredMixin, generic.ListView):
-    """This view shows the list of tasks.
+class IndexView(LoginRequiredMixin, TaskListConditionalMixin, KeysetPaginationMixin, CachedTaskRowsMixin, generic.ListView):
+    """This view shows the list of tasks, one page (see KeysetPaginationMixin) at a time.
 
     Attributes:
         template_name: The URL of the respective HTML template file
         context_object_name: The name of the list in the template
+        is_finished: Whether closed tasks are shown (see TaskListConditionalMixin)
     """
     template_name = 'tasks/listopentasks.html'
     context_object_name = 'tasks_list'
+    is_finished = False
 
     def get_queryset(self):
         """This function retrieves all tasks according to a filter.
+        The filter is a full-text search (see tasks/search.py) whose results are ordered by relevance.
+        Assignees and labels are prefetched for the rows that are not cached (see CachedTaskRowsMixin).
         """
         filter = self.request.GET.get('filter', '')
-        return Task.objects.filter(is_finished=False, task_text__contains=filter).order_by('finished_date')
+        tasks = Task.objects.filter(is_finished=self.is_finished).order_by('finished_date', 'id')
+        return search.search(tasks, filter)
 
-class ClosedTasksView(LoginRequiredMixin, generic.ListView):
-    """ This view shows the list of closed tasks
+class ClosedTasksView(IndexView):
+    """ This view shows the list of closed tasks, one page (see KeysetPaginationMixin) at a time.
 
     Attributes
         template_name: The path to the respective HTML template file
-        context_object_name: The name of the list in the template
+        is_finished: Whether closed tasks are shown (see TaskListConditionalMixin)
     """
     template_name = 'tasks/listclosedtasks.html'
-    context_object_name = 'tasks_list'
+    is_finished = True
 
-    def get_queryset(self):
-        """This function retrieves all tasks according to a filter.
-        """
-        filter = self.request.GET.get('filter', '')
-        return Task.objects.filter(is_finished=True, task_text__contains=filter).order_by('finished_date')
+def wants_json(request):
+    """This function checks whether the client asked for JSON instead of HTML (e.g. "Accept: application/json").
+    """
+    return 'application/json' in request.META.get('HTTP_ACCEPT', '')
 
-class DetailView(LoginRequiredMixin, generic.CreateView):
-    """This view shows the details of a certain task.
+class DetailView(LoginRequiredMixin, TaskConditionalMixin, generic.CreateView):
+    """This view shows the details of a certain task with its newest comments (see CommentsView for the older ones).
 
     Attributes:
         model: The model to be used (in this case, a Task)
@@ -59,6 +68,15 @@ class DetailView(LoginRequiredMixin, generic.CreateView):
     template_name = 'tasks/detail.html'
     form_class = CreateCommentForm
 
+    task = None
+
+    def get_object(self, queryset=None):
+        """This function retrieves the task, which is loaded only once per request.
+        """
+        if self.task is None:
+            self.task = super().get_object(queryset)
+        return self.task
+
     def get_success_url(self):
         """This function retrieves the URL to which the user is redirected on successful use of the view.
         """
@@ -66,25 +84,68 @@ class DetailView(LoginRequiredMixin, generic.CreateView):
 
     def get_context_data(self, **kwargs):
         """This function retrieves the contextual data for a given task (i. e., task, members (assignees), comments, labels).
+        Assignees, labels and the newest page of comments (with their authors) are loaded with one query each.
         """
         context = super().get_context_data(**kwargs)
-        context['task'] = self.get_object()
-        context['members'] = User.objects.filter(task=self.get_object())
-        context['comments'] = Comment.objects.filter(comment_task=self.get_object())
-        context['labels'] = Label.objects.filter(task=self.get_object())
+        task = self.get_object()
+        prefetch_related_objects([task], 'assignedTo', 'labels')
+        context['task'] = task
+        context['members'] = task.assignedTo.all()
+        context['comments'], context['older_comments'] = comment_page(
+            Comment.objects.filter(comment_task=task).select_related('comment_user'), '')
+        context['labels'] = task.labels.all()
         return context
 
     def form_valid(self, form):
         """This function checks whether the form is filled in correctly or not.
+        The comment is saved and the user is redirected to the task, so the page is not rendered twice.
+        Requests sent by the script of the page (or asking for JSON) get only the new comment instead.
         """
-        self.obj = form.save(commit=False)
-        self.obj.comment_task = self.get_object()
-        self.obj.comment_date = timezone.now()
-        self.obj.comment_user = self.request.user
-        self.obj.save()
-        response = super(DetailView, self).form_valid(form)
+        self.object = form.save(commit=False)
+        self.object.comment_task = self.get_object()
+        self.object.comment_date = timezone.now()
+        self.object.comment_user = self.request.user
+        self.object.save()
+
+        if wants_json(self.request):
+            return JsonResponse(CommentSerializer(self.object).data, status=201)
+        if self.request.is_ajax():
+            return render(self.request, 'tasks/comment.html', {'comment': self.object}, status=201)
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        """This function shows the form with its errors, or returns the errors if the comment was sent by a script.
+        """
+        if wants_json(self.request) or self.request.is_ajax():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return super().form_invalid(form)
 
-        return self.render_to_response(self.get_context_data(form=form))
+class CommentsView(LoginRequiredMixin, TaskConditionalMixin, generic.TemplateView):
+    """This view returns the comments of a task older than the cursor given as the GET parameter "before",
+    one page (see comment_page) at a time, as an HTML fragment ending in the button loading the next page,
+    or as JSON ({"comments": [...], "before": cursor}) if the client asks for it.
+
+    Attributes:
+        template_name: The URL of the respective HTML template file
+    """
+    template_name = 'tasks/comments.html'
+
+    def get_context_data(self, **kwargs):
+        """This function retrieves the comments (with their authors) with one query.
+        """
+        context = super().get_context_data(**kwargs)
+        comments = Comment.objects.filter(comment_task_id=self.kwargs['pk']).select_related('comment_user')
+        context['comments'], context['older_comments'] = comment_page(comments, self.request.GET.get('before', ''))
+        if not context['comments'] and not Task.objects.filter(pk=self.kwargs['pk']).exists():
+            raise Http404("No task found matching the query")
+        context['task_id'] = self.kwargs['pk']
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if wants_json(self.request):
+            return JsonResponse({'comments': CommentSerializer(context['comments'], many=True).data,
+                                 'before': context['older_comments']})
+        return super().render_to_response(context, **response_kwargs)
 
 class NewTaskView(LoginRequiredMixin, generic.CreateView):
     """This view shows the form for creating a new task.
@@ -154,8 +215,12 @@ class EditTaskView(LoginRequiredMixin, generic.UpdateView):
         """This function checks whether the form is filled in correctly or not.
         """
         #save cleaned post data
-        self.object = form.save()
-        return super(EditTaskView, self).form_valid(form)
+        self.object = form.save(commit=False)
+        # the comment stats of the task may have changed since it was loaded
+        self.object.save(update_fields=task_update_fields(form._meta.fields))
+        form.save_m2m()
+        # not ModelFormMixin.form_valid(), which would save the whole task again
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_context_data(self, **kwargs):
         """This function retrieves the contextual data needed for creating a new task (i. e., labels, members (possible assignees), due date and current labels and members (assignees)).
@@ -177,28 +242,83 @@ class ImpressumView(generic.TemplateView):
 
 def finishTask(request, task_id):
     """This function closes a task upon user request.
+    Only the state and the modification date of the task are written (see bulk.set_finished).
     """
     if not request.user.is_authenticated:
         return HttpResponseRedirect(reverse('tasks:index'))
-    task = get_object_or_404(Task, pk=task_id)
+    task = get_object_or_404(Task.objects.only('id'), pk=task_id)
 
-    task.is_finished = True;
-    task.save()
+    bulk.set_finished([task.pk], True)
 
     return HttpResponseRedirect(reverse('tasks:index'))
 
 def reopen(request, task_id):
     """This function reopens a task upon user request.
+    Only the state and the modification date of the task are written (see bulk.set_finished).
     """
     if not request.user.is_authenticated:
         return HttpResponseRedirect(reverse('tasks:closedTasks'))
-    task = get_object_or_404(Task, pk=task_id)
+    task = get_object_or_404(Task.objects.only('id'), pk=task_id)
 
-    task.is_finished = False;
-    task.save()
+    bulk.set_finished([task.pk], False)
 
     return HttpResponseRedirect(reverse('tasks:closedTasks'))
 
+class BatchActionView(LoginRequiredMixin, generic.FormView):
+    """This view applies an action to the tasks selected in a task list.
+
+    Closing and reopening are done at once. For setting labels or assignees the view first shows a form
+    for choosing them, which is posted back with "confirm". Every action is a single set-based
+    UPDATE or a bulk replacement of the assignments (see tasks/bulk.py).
+
+    Attributes:
+        template_name: The URL of the respective HTML template file
+        form_class: The form class used in this view
+        http_method_names: The view is only posted to from the task lists
+    """
+    template_name = 'tasks/batch.html'
+    form_class = BatchActionForm
+    http_method_names = ['post']
+
+    def form_valid(self, form):
+        action = form.cleaned_data['action']
+        if action in ('relabel', 'reassign') and 'confirm' not in self.request.POST:
+            return self.render_to_response(self.get_context_data(form=form))
+
+        task_ids = [task.pk for task in form.cleaned_data['tasks']]
+        if action == 'close':
+            count = bulk.set_finished(task_ids, True)
+            messages.success(self.request, "%d tasks were closed." % count)
+        elif action == 'reopen':
+            count = bulk.set_finished(task_ids, False)
+            messages.success(self.request, "%d tasks were reopened." % count)
+        elif action == 'relabel':
+            bulk.set_relations('labels', task_ids, [(task_id, label.pk) for task_id in task_ids for label in form.cleaned_data['labels']])
+            messages.success(self.request, "The labels of %d tasks were set." % len(task_ids))
+        else:
+            bulk.set_relations('assignedTo', task_ids, [(task_id, user.pk) for task_id in task_ids for user in form.cleaned_data['assignedTo']])
+            messages.success(self.request, "The assignees of %d tasks were set." % len(task_ids))
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(self.request, error)
+        return HttpResponseRedirect(self.get_success_url())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cancel_url'] = self.get_success_url()
+        return context
+
+    def get_success_url(self):
+        """This function returns the task list from which the action was started.
+        """
+        url = self.request.POST.get('next', '')
+        if is_safe_url(url, allowed_hosts={self.request.get_host()}, require_https=self.request.is_secure()):
+            return url
+        return reverse('tasks:index')
+
 class ProtocolParse(LoginRequiredMixin, generic.FormView):
     """This view shows the form for having a protocol parsed and adding its contents to the todo database.
 
@@ -213,62 +333,44 @@ class ProtocolParse(LoginRequiredMixin, generic.FormView):
 
     def form_valid(self, form):
         """This function checks whether the form is filled in correctly or not.
+        All TODOs of the protocol are imported in one transaction, unknown assignees are reported to the user.
+        A protocol given by its URL is only imported again if it has changed (see tasks/fetch.py).
         """
-        text = self.request.POST['protocol_text']
-        rows = re.split('\n', text)
-        email_task_content = ""
-        description = ""
-        text = ""
-        email_content = ""
-        for row in rows:
-            #depricated for etherpad: if row.startswith('* '):
-
-            # if a new topic starts
-            if row.startswith('#### '):
-
-                # if previous topic has TODOs
-                if text != "":
-                    # create e-mail subheader based on topics for TODOs
-                    add_topic = "Thema in der Sitzung: " + description + "\n" + email_task_content
-                    # reset e-mail content
-                    email_task_content = ""
-                    # add TODO tasks after topic title
-                    email_content += add_topic
-                    # reset task text
-                    text = ""
-
-                description = row[5:]
-
-            if 'TODO' in row:
-                todo = row[row.find('TODO'):]
-                if ':' in todo:
-                    users, text = todo.split(':', 1)
-
-                    task = Task.objects.create(task_text=text,
-                                               task_description='zum Thema in der Sitzung: '+description,
-                                               finished_date=(timezone.now() + timedelta(days=7)),
-                                               creation_date=timezone.now(),
-                                               is_finished=False,
-                                               important=False)
-
-                    email_task_content += "  TODO:          " + text + "\n  Beauftragte(r): " + users[5:] + "\n\n"
-
-                    for user in [x.strip() for x in users[5:].split(",")]:
-                        try:
-                            user_obj = User.objects.get(username=user.lower())
-                            task.assignedTo.add(user_obj)
-                        except User.DoesNotExist:
-                            None
-
-        # in case last topic has TODOs
-        if text != "":
-            add_topic = "Thema in der Sitzung: " + description + "\n" + email_task_content
-            email_task_content = ""
-            email_content += add_topic
-            text = ""
-
-        email_content = "Heyho,\n\nin der Sitzung wurden neue Aufgaben verteilt.\n\n" + email_content + "Euch noch ein frohes Schaffen\nFrudo"
-        mail = EmailMessage('SitzungsTODOs', email_content, settings.EMAIL_HOST_USER, [settings.EMAIL_GROUP_RECEIVE])
-        if (settings.EMAIL_HOST != "example.com"):
-            mail.send()
+        url = None
+        if form.cleaned_data.get('protocol_file'):
+            todos = protocol.file_todos(form.cleaned_data['protocol_file'])
+        elif form.cleaned_data.get('protocol_text'):
+            todos = list(protocol.todos(protocol.text_lines(form.cleaned_data['protocol_text'])))
+        else:
+            url = form.cleaned_data['protocol_url']
+            try:
+                fetched = fetch.fetch(url)
+            except fetch.ProtocolFetchError as error:
+                form.add_error('protocol_url', str(error))
+                return self.form_invalid(form)
+            if fetched is None:
+                messages.info(self.request, "The protocol has not changed since its last import, nothing was imported.")
+                return HttpResponseRedirect(self.get_success_url())
+            path, encoding = fetched
+            try:
+                with open(path, 'rb') as f:
+                    todos = protocol.file_todos(f, encoding)
+            except (LookupError, UnicodeDecodeError) as error:
+                # fetch the protocol again on the next try
+                fetch.forget(url)
+                form.add_error('protocol_url', "The protocol could not be decoded: %s" % error)
+                return self.form_invalid(form)
+
+        try:
+            tasks, unknown_users = protocol.import_todos(todos)
+        except Exception:
+            if url:
+                # fetch the protocol again on the next try
+                fetch.forget(url)
+            raise
+        if unknown_users:
+            messages.warning(self.request, "The following users are unknown and were not assigned: " + ", ".join(unknown_users))
+
+        # the mail is sent by the send_queued_mail command, so a slow mail server does not block the request
+        outbox.enqueue('SitzungsTODOs', protocol.mail_body(todos), [settings.EMAIL_GROUP_RECEIVE])
         return super(ProtocolParse, self).form_valid(form)
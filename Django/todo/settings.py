@@ -26,7 +26,8 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = '+0q&zbs2c9$1av@lt=np)ju5h331v)zwg#l+2u9@+ob2gxsm+^'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# (the container turns it off, see entrypoint.sh)
+DEBUG = ( os.environ.get('DEBUG', 'True') == 'True' )
 
 
 ALLOWED_HOSTS = [os.environ.get('ALLOWED_HOSTS', ''), 'localhost', '127.0.0.1']
@@ -41,17 +42,24 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # lets runserver leave the static files to WhiteNoiseMiddleware
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'tasks.middleware.RequestMetricsMiddleware',
+    'tasks.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tasks.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'todo.urls'
@@ -73,7 +81,8 @@ TEMPLATES = [
 ]
 
 AUTHENTICATION_BACKENDS = [
-    'django_auth_ldap.backend.LDAPBackend',
+    # django_auth_ldap.backend.LDAPBackend with a cache of successful logins (see tasks/ldapauth.py)
+    'tasks.ldapauth.CachedLDAPBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -84,13 +93,82 @@ WSGI_APPLICATION = 'todo.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# SQLite is used by default. DATABASE_ENGINE=postgresql switches to PostgreSQL, configured by
+# DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST and DATABASE_PORT.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'django.db.backends.' + DATABASE_ENGINE,
+        'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        # seconds a connection is kept open for the following requests (0 closes it after every request)
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+        # seconds SQLite waits for a lock before raising "database is locked"
+        'OPTIONS': {'timeout': float(os.environ.get('SQLITE_TIMEOUT', 20))} if DATABASE_ENGINE == 'sqlite3' else {},
     }
 }
 
+# Read replicas: DATABASE_REPLICAS is a comma separated list of the file names (SQLite) or hosts
+# (PostgreSQL) of read-only copies of the default database. Reads are sent to them by tasks/routers.py.
+DATABASE_REPLICA_ALIASES = []
+for number, replica in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    DATABASES['replica%d' % number] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                                           **{'NAME' if DATABASE_ENGINE == 'sqlite3' else 'HOST': replica.strip()})
+    DATABASE_REPLICA_ALIASES.append('replica%d' % number)
+
+DATABASE_ROUTERS = ['tasks.routers.ReplicaRouter']
+
+# seconds a client reads from the default database after it wrote, so it does not miss its own changes
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+# PRAGMAs run on every new SQLite connection (see tasks/signals.py). In WAL mode readers do not
+# block behind a writer, and synchronous=normal only syncs at checkpoints. The cache size is in
+# KiB when negative, the mmap size in bytes. SQLITE_JOURNAL_MODE=delete restores the defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -20000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'memory'),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+# The rendered rows of the task lists are kept in local memory by default. With several worker
+# processes a shared cache should be used, e.g. TASK_ROW_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# and TASK_ROW_CACHE_LOCATION=/var/tmp/frudo_rows. The task_row_cache command only works with a shared cache.
+# repair_comment_stats, generate_data and parse_protocol warn that they cannot invalidate the rows of a local cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'task_rows': {
+        'BACKEND': os.environ.get('TASK_ROW_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('TASK_ROW_CACHE_LOCATION', 'task_rows'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('TASK_ROW_CACHE_MAX_ENTRIES', 20000)),
+        },
+    },
+    'sessions': {
+        'BACKEND': os.environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', 'sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+TASK_ROW_CACHE = 'task_rows'
+
+TASK_ROW_CACHE_TIMEOUT = int(os.environ.get('TASK_ROW_CACHE_TIMEOUT', 24 * 60 * 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -112,9 +190,12 @@ AUTH_PASSWORD_VALIDATORS = [
 
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
-    '/var/www/static/',
 ]
 
+# collectstatic fails on a missing directory
+if os.path.isdir('/var/www/static/'):
+    STATICFILES_DIRS.append('/var/www/static/')
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.0/topics/i18n/
@@ -148,6 +229,61 @@ EMAIL_USE_SSL = ( os.environ.get('EMAIL_USE_SSL', 'False') == 'True' )
 
 EMAIL_GROUP_RECEIVE = os.environ.get('EMAIL_GROUP_RECEIVE', 'user@example.com')
 
+# Outbox (see the send_queued_mail command)
+
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.environ.get('MAIL_QUEUE_MAX_ATTEMPTS', 5))
+
+MAIL_QUEUE_RETRY_DELAY = int(os.environ.get('MAIL_QUEUE_RETRY_DELAY', 60))
+
+# seconds for which a run of send_queued_mail claims the mails it sends; they are only tried again by another run
+# (e.g. the cron job next to the --loop worker) after the run that claimed them died
+MAIL_QUEUE_LEASE = int(os.environ.get('MAIL_QUEUE_LEASE', 600))
+
+# Task list settings
+
+TASKS_PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', 50))
+
+# number of comments shown on the detail page and loaded per click on "Show older comments"
+COMMENTS_PAGE_SIZE = int(os.environ.get('COMMENTS_PAGE_SIZE', 20))
+
+# Protocols fetched from an URL (see tasks/fetch.py)
+
+PROTOCOL_CACHE_DIR = os.environ.get('PROTOCOL_CACHE_DIR', os.path.join(BASE_DIR, 'protocol_cache'))
+
+PROTOCOL_FETCH_TIMEOUT = float(os.environ.get('PROTOCOL_FETCH_TIMEOUT', 10))
+
+PROTOCOL_FETCH_MAX_SIZE = int(os.environ.get('PROTOCOL_FETCH_MAX_SIZE', 5 * 1024 * 1024))
+
+# comma separated host names (e.g. pad.example.org) from which protocols may be fetched; none by default, so that
+# users cannot make the server request internal addresses
+PROTOCOL_URL_HOSTS = [host.strip().lower() for host in os.environ.get('PROTOCOL_URL_HOSTS', '').split(',') if host.strip()]
+
+# REST API (see tasks/api.py)
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+    'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
+    'DEFAULT_PAGINATION_CLASS': 'tasks.pagination.IdCursorPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', 100)),
+}
+
+# maximal number of tasks written by one request to /api/tasks/bulk/
+API_BULK_MAX_SIZE = int(os.environ.get('API_BULK_MAX_SIZE', 1000))
+
+# Sessions
+# https://docs.djangoproject.com/en/2.0/topics/http/sessions/#using-cached-sessions
+
+# cached_db reads sessions from the cache and writes them through to the database, so a request
+# does not query the session table. The cache engine (SESSION_ENGINE=django.contrib.sessions.backends.cache)
+# skips the database entirely, but then the sessions cache must be shared by all processes and
+# survive restarts. Expired sessions are removed from the database by the cleanup_sessions command.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+SESSION_CACHE_ALIAS = 'sessions'
+
 # Login Stuff
 
 LOGIN_REDIRECT_URL = '/tasks'
@@ -169,7 +305,69 @@ AUTH_LDAP_USER_ATTR_MAP = {
     "email": "mail"
 }
 
+# the attributes of existing users are updated by tasks.ldapauth.CachedLDAPBackend, only if they changed
+AUTH_LDAP_ALWAYS_UPDATE_USER = False
+
+# seconds a successful login is remembered without asking the directory again (0 disables the cache)
+LDAP_AUTH_CACHE_TIMEOUT = int(os.environ.get('LDAP_AUTH_CACHE_TIMEOUT', 300))
+
+# the cache of the logins and of their counters; the ldap_auth_stats command only works with a shared cache
+LDAP_AUTH_CACHE = 'default'
+
+# per request measurements, see tasks.middleware.RequestMetricsMiddleware
+REQUEST_METRICS = ( os.environ.get('REQUEST_METRICS', 'True') == 'True' )
+
+# requests slower than this (in milliseconds) or with more queries are logged as warnings with their duplicate queries
+REQUEST_METRICS_SLOW_MS = float(os.environ.get('REQUEST_METRICS_SLOW_MS', 500))
+
+REQUEST_METRICS_MAX_QUERIES = int(os.environ.get('REQUEST_METRICS_MAX_QUERIES', 30))
+
+# superusers can have a request profiled, see tasks.middleware.ProfilerMiddleware
+PROFILE_REQUESTS = ( os.environ.get('PROFILE_REQUESTS', 'True') == 'True' )
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# the oldest profiles are deleted when PROFILE_DIR grows beyond this
+PROFILE_DIR_MAX_BYTES = int(os.environ.get('PROFILE_DIR_MAX_BYTES', 100 * 1024 * 1024))
+
+# Prometheus metrics at /metrics, see tasks/metrics.py; scrapers have to send "Authorization: Bearer <token>".
+# Without a token /metrics answers 404, unless DEBUG is on.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# seconds the task and outbox gauges of the metrics are cached
+METRICS_AGGREGATE_TIMEOUT = int(os.environ.get('METRICS_AGGREGATE_TIMEOUT', 60))
+
+METRICS_AGGREGATE_CACHE = 'default'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # one line of JSON per request, WARNING logs only the slow requests
+        'tasks.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_METRICS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic copies the files here, see entrypoint.sh
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# the collected files get the hash of their content in their name, and gzip and brotli compressed variants
+STATICFILES_STORAGE = 'tasks.storage.StaticFilesStorage'
+
+# seconds a static file requested by its plain name (e.g. /static/favicon.ico) may be cached,
+# the hashed names used by the templates are cached for ten years and marked immutable
+WHITENOISE_MAX_AGE = 0 if DEBUG else int(os.environ.get('STATIC_MAX_AGE', 60))
@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from tasks import views as taskview
+from tasks import api, metrics, views as taskview
 
 urlpatterns = [
     path('', taskview.IndexView.as_view(), name='table'),
@@ -23,5 +23,7 @@ urlpatterns = [
     #url('login/', auth_views.login, name='login'),
     #url('logout/', auth_views.logout, name='logout'),
     path('tasks/', include('tasks.urls')),
+    path('api/', include(api.router.urls)),
     path('account/', include('django.contrib.auth.urls')),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
@@ -1,3 +1,29 @@
 #!/bin/bash
 
-python3 manage.py runserver 0.0.0.0:8000
+# the container serves the app in production mode unless DEBUG=True is given, so WhiteNoise serves the
+# hashed, compressed static files with their long caching headers (see todo/settings.py)
+export DEBUG=${DEBUG:-False}
+
+# the processes share their Prometheus metrics through this directory (see tasks/metrics.py)
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/var/opt/metrics}
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR" && rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+
+python3 manage.py collectstatic --noinput
+
+# The mail worker and the web server run side by side. If either of them ends, the other one is stopped and the
+# container exits with its status, so the restart policy of the container (docker run --restart unless-stopped)
+# starts both again instead of leaving the outbox or the site dead.
+python3 manage.py send_queued_mail --loop &
+mail=$!
+# One process with several threads: the task row, session and LDAP caches are kept in the memory of the
+# process by default. More workers (WEB_WORKERS) need shared caches, see CACHES in todo/settings.py.
+gunicorn todo.wsgi:application --bind 0.0.0.0:8000 --workers "${WEB_WORKERS:-1}" --threads "${WEB_THREADS:-8}" \
+    --access-logfile - &
+web=$!
+
+trap 'kill -TERM $mail $web 2>/dev/null' TERM INT
+wait -n
+status=$?
+kill -TERM $mail $web 2>/dev/null
+wait
+exit $status